@@ -2,7 +2,7 @@ from __future__ import absolute_import
 
 from django.contrib import admin
 
-from .models import Follow, Friend, FriendshipRequest
+from .models import Follow, Friend, FriendshipRequest, OutboxEvent, Suggestion
 
 
 class FollowAdmin(admin.ModelAdmin):
@@ -20,6 +20,19 @@ class FriendshipRequestAdmin(admin.ModelAdmin):
     raw_id_fields = ('from_user', 'to_user')
 
 
+class SuggestionAdmin(admin.ModelAdmin):
+    model = Suggestion
+    raw_id_fields = ('user', 'candidate')
+
+
+class OutboxEventAdmin(admin.ModelAdmin):
+    model = OutboxEvent
+    list_display = ('type', 'actor', 'target', 'subject', 'created', 'attempts', 'failed')
+    list_filter = ('type', 'failed')
+
+
 admin.site.register(Follow, FollowAdmin)
 admin.site.register(Friend, FriendAdmin)
 admin.site.register(FriendshipRequest, FriendshipRequestAdmin)
+admin.site.register(OutboxEvent, OutboxEventAdmin)
+admin.site.register(Suggestion, SuggestionAdmin)
@@ -17,8 +17,31 @@ class RestFriendshipConfig(AppConfig):
     def user_serializer(self):
         return self.customized_settings.get('USER_SERIALIZER', 'rest_friendship.serializers.UserSerializer')
 
-    #def ready(self):
-        # """Override this to put in:
-        #     Users system checks
-        #     Users signal registration
-        # """
+    @property
+    def cache_alias(self):
+        return self.customized_settings.get('CACHE_ALIAS', 'default')
+
+    @property
+    def suggestions_size(self):
+        return self.customized_settings.get('SUGGESTIONS_SIZE', 50)
+
+    @property
+    def event_broker(self):
+        return self.customized_settings.get('EVENT_BROKER', 'rest_friendship.events.LocalBroker')
+
+    @property
+    def deferred_signals(self):
+        # False: inline, True: thread pool after commit, 'outbox': sent from the OutboxEvent rows by `drain_outbox`
+        return self.customized_settings.get('DEFERRED_SIGNALS', False)
+
+    @property
+    def signal_workers(self):
+        return self.customized_settings.get('SIGNAL_WORKERS', 4)
+
+    @property
+    def outbox_max_attempts(self):
+        return self.customized_settings.get('OUTBOX_MAX_ATTEMPTS', 5)
+
+    def ready(self):
+        # Connect the event publishers
+        from rest_friendship import events  # noqa
@@ -0,0 +1,81 @@
+import logging
+import threading
+from concurrent import futures
+
+from django.apps import apps
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+_pending_lock = threading.Lock()
+
+# REST_FRIENDSHIP['DEFERRED_SIGNALS'] value sending the signals from the outbox events
+OUTBOX = 'outbox'
+
+
+def get_executor():
+    """
+    Return the thread pool running the deferred signals, one per process
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = apps.get_app_config('rest_friendship').signal_workers
+            _executor = futures.ThreadPoolExecutor(max_workers=workers)
+        return _executor
+
+
+def send(signal, sender, **kwargs):
+    """
+    Send a rest_friendship signal, right away or, when REST_FRIENDSHIP
+    ['DEFERRED_SIGNALS'] is set, once the current transaction commits on
+    the background thread pool. With 'outbox' nothing is sent here: the
+    write recorded an OutboxEvent in its transaction and the `drain_outbox`
+    command sends the signal from it.
+    """
+    mode = apps.get_app_config('rest_friendship').deferred_signals
+    if not mode:
+        return signal.send(sender=sender, **kwargs)
+
+    if mode == OUTBOX:
+        return
+
+    def submit():
+        future = get_executor().submit(run, signal, sender, kwargs)
+        with _pending_lock:
+            _pending.add(future)
+        future.add_done_callback(discard)
+
+    transaction.on_commit(submit)
+
+
+def discard(future):
+    with _pending_lock:
+        _pending.discard(future)
+
+
+def run(signal, sender, kwargs):
+    """
+    Send a deferred signal, receivers errors are logged as nobody is
+    left to handle them
+    """
+    try:
+        for receiver, response in signal.send_robust(sender=sender, **kwargs):
+            if isinstance(response, Exception):
+                logger.error('Error in %r receiver of %r', receiver, signal,
+                             exc_info=(type(response), response, response.__traceback__))
+    finally:
+        # Worker threads don't go through the request cycle cleanup
+        close_old_connections()
+
+
+def wait(timeout=None):
+    """
+    Wait for the deferred signals submitted so far, for tests and shutdown
+    """
+    with _pending_lock:
+        pending = list(_pending)
+    return futures.wait(pending, timeout)
@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from rest_friendship.models import cache
+from rest_friendship.signals import (
+    friendship_request_created, friendship_request_canceled, friendship_request_accepted, following_created
+)
+
+
+class LocalBroker(object):
+    """
+    In-process broker keeping the last `size` events of each user, only
+    sees the events of its own worker: for tests and single process
+    deployments
+    """
+
+    def __init__(self, size=100):
+        self.condition = threading.Condition()
+        self.events = defaultdict(lambda: deque(maxlen=size))
+        self.last_ids = defaultdict(int)
+
+    def publish(self, user_pk, event):
+        with self.condition:
+            self.last_ids[user_pk] += 1
+            self.events[user_pk].append(dict(event, id=self.last_ids[user_pk]))
+            self.condition.notify_all()
+
+    def last_id(self, user_pk):
+        with self.condition:
+            return self.last_ids.get(user_pk, 0)
+
+    def poll(self, user_pk, since, timeout):
+        """ Wait up to timeout seconds for the events of user after since """
+        with self.condition:
+            self.condition.wait_for(lambda: self.last_ids.get(user_pk, 0) > since, timeout)
+            return [event for event in self.events.get(user_pk, ()) if event['id'] > since]
+
+
+class CacheBroker(object):
+    """
+    Cross-worker broker over the friendship cache tier: each user has an
+    atomic event counter and one key per event. A single watcher thread per
+    process reads the counters of all the waiting users every `interval`
+    seconds and wakes them, so the cache load does not grow with the number
+    of pollers
+    """
+
+    def __init__(self, size=100, interval=0.5, timeout=3600):
+        self.size = size
+        self.interval = interval
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.waiters = defaultdict(int)
+        self.last_ids = {}
+        self.watcher = None
+
+    def publish(self, user_pk, event):
+        key = 'events-%s' % user_pk
+        cache.add(key, 0, None)
+        event_id = cache.incr(key)
+        cache.set('event-%s-%s' % (user_pk, event_id), dict(event, id=event_id), self.timeout)
+        # Wake the pollers of this process without waiting for the watcher
+        with self.condition:
+            if user_pk in self.waiters:
+                self.last_ids[user_pk] = max(self.last_ids.get(user_pk, 0), event_id)
+                self.condition.notify_all()
+
+    def last_id(self, user_pk):
+        return cache.get('events-%s' % user_pk, 0)
+
+    def watch(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.waiters)
+                user_pks = list(self.waiters)
+            counters = cache.get_many(['events-%s' % user_pk for user_pk in user_pks])
+            with self.condition:
+                for user_pk in user_pks:
+                    self.last_ids[user_pk] = max(self.last_ids.get(user_pk, 0),
+                                                 counters.get('events-%s' % user_pk, 0))
+                self.condition.notify_all()
+            time.sleep(self.interval)
+
+    def poll(self, user_pk, since, timeout):
+        """ Wait up to timeout seconds for the events of user after since """
+        last_id = self.last_id(user_pk)
+        if last_id <= since and timeout > 0:
+            with self.condition:
+                if self.watcher is None:
+                    self.watcher = threading.Thread(target=self.watch, name='friendship-events', daemon=True)
+                    self.watcher.start()
+                self.waiters[user_pk] += 1
+                self.last_ids[user_pk] = max(self.last_ids.get(user_pk, 0), last_id)
+                try:
+                    self.condition.wait_for(lambda: self.last_ids[user_pk] > since, timeout)
+                    last_id = self.last_ids[user_pk]
+                finally:
+                    self.waiters[user_pk] -= 1
+                    if not self.waiters[user_pk]:
+                        del self.waiters[user_pk]
+                        del self.last_ids[user_pk]
+
+        keys = ['event-%s-%s' % (user_pk, event_id)
+                for event_id in range(max(since, last_id - self.size) + 1, last_id + 1)]
+        return sorted(cache.get_many(keys).values(), key=lambda event: event['id'])
+
+
+_brokers = {}
+
+_waiters = {'count': 0}
+_waiters_lock = threading.Lock()
+
+
+@contextmanager
+def waiter_slot(limit):
+    """
+    Hold one of the `limit` long poll slots of the process, yields False when
+    they are all taken so the request is answered instead of tying up a thread
+    """
+    with _waiters_lock:
+        acquired = _waiters['count'] < limit
+        if acquired:
+            _waiters['count'] += 1
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with _waiters_lock:
+                _waiters['count'] -= 1
+
+
+def get_broker():
+    """
+    Return the broker configured in REST_FRIENDSHIP['EVENT_BROKER'], one
+    instance per process
+    """
+    path = apps.get_app_config('rest_friendship').event_broker
+    if path not in _brokers:
+        _brokers[path] = import_string(path)()
+    return _brokers[path]
+
+
+@receiver(friendship_request_created)
+def publish_request_created(sender, **kwargs):
+    get_broker().publish(sender.to_user_id, {'type': 'friendship_request_created', 'request': sender.pk,
+                                             'user': sender.from_user_id})
+
+
+@receiver(friendship_request_canceled)
+def publish_request_canceled(sender, **kwargs):
+    get_broker().publish(sender.to_user_id, {'type': 'friendship_request_canceled', 'request': sender.pk,
+                                             'user': sender.from_user_id})
+
+
+@receiver(friendship_request_accepted)
+def publish_request_accepted(sender, from_user, to_user, **kwargs):
+    get_broker().publish(from_user.pk, {'type': 'friendship_request_accepted', 'user': to_user.pk})
+
+
+@receiver(following_created)
+def publish_following_created(sender, following, **kwargs):
+    get_broker().publish(following.followee_id, {'type': 'following_created', 'user': following.follower_id})
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rest_friendship.models import OutboxEvent
+
+
+class Command(BaseCommand):
+    help = ('Deliver the outbox events to the outbox_events receivers, and send their signals with '
+            "REST_FRIENDSHIP['DEFERRED_SIGNALS'] = 'outbox', in batches, then delete them")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of events delivered and deleted per transaction')
+        parser.add_argument('--follow', action='store_true',
+                            help='Keep polling for new events instead of exiting once the outbox is empty')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait between polls of an empty outbox with --follow')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Put the events set aside after too many failed deliveries back in the outbox first')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['retry_failed']:
+            self.stdout.write('Retrying %s failed events' % OutboxEvent.objects.retry_failed())
+        events = 0
+        while True:
+            drained = OutboxEvent.objects.drain(batch_size)
+            events += drained
+            if drained < batch_size:
+                if not options['follow']:
+                    break
+                time.sleep(options['interval'])
+        self.stdout.write('Drained %s events' % events)
+        failed = OutboxEvent.objects.filter(failed__isnull=False).count()
+        if failed:
+            self.stderr.write('%s events failed too many times, see the outbox admin' % failed)
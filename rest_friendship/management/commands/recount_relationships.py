@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from rest_friendship.models import recount
+
+
+class Command(BaseCommand):
+    help = 'Recompute the friend, follower and following counters of profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_ids', nargs='*', type=int,
+                            help='Only recount these profiles, all of them by default')
+
+    def handle(self, *args, **options):
+        count = recount(options['profile_ids'] or None)
+        self.stdout.write('Recounted %s profiles' % count)
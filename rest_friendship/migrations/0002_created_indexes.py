@@ -0,0 +1,33 @@
+# Generated by Django 2.0.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_friendship', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='friendshiprequest',
+            index=models.Index(fields=['to_user', 'created'], name='friendreq_to_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='friendshiprequest',
+            index=models.Index(fields=['from_user', 'created'], name='friendreq_from_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='friend',
+            index=models.Index(fields=['to_user', 'created'], name='friend_to_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['followee', 'created'], name='follow_followee_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['follower', 'created'], name='follow_follower_created_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.0.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_profile', '0009_merge_20180624_1801'),
+        ('rest_friendship', '0002_created_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Suggestion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mutual_count', models.PositiveIntegerField(default=0)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('candidate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='rest_profile.Profile')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='suggestions', to='rest_profile.Profile')),
+            ],
+            options={
+                'verbose_name': 'Suggestion',
+                'verbose_name_plural': 'Suggestions',
+                'ordering': ('-mutual_count', '-updated', '-id'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='suggestion',
+            unique_together={('user', 'candidate')},
+        ),
+        migrations.AddIndex(
+            model_name='suggestion',
+            index=models.Index(fields=['user', '-mutual_count', '-updated'], name='suggestion_user_rank_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.0.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def recount_profiles(apps, schema_editor):
+    Profile = apps.get_model('rest_profile', 'Profile')
+    Friend = apps.get_model('rest_friendship', 'Friend')
+    Follow = apps.get_model('rest_friendship', 'Follow')
+
+    def count(model, field):
+        qs = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)
+        return Coalesce(Subquery(qs.annotate(count=Count('pk')).values('count'),
+                                 output_field=models.PositiveIntegerField()), 0)
+
+    Profile.objects.update(
+        friend_count=count(Friend, 'to_user'),
+        follower_count=count(Follow, 'followee'),
+        following_count=count(Follow, 'follower'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_profile', '0010_profile_counters'),
+        ('rest_friendship', '0003_suggestion'),
+    ]
+
+    operations = [
+        migrations.RunPython(recount_profiles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.0.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_friendship', '0004_recount_profiles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('request_created', 'Friendship request created'), ('request_accepted', 'Friendship request accepted'), ('request_rejected', 'Friendship request rejected'), ('request_canceled', 'Friendship request canceled'), ('friendship_removed', 'Friendship removed'), ('follow_created', 'Follow created'), ('follow_removed', 'Follow removed')], max_length=20)),
+                ('actor', models.IntegerField()),
+                ('target', models.IntegerField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Outbox Event',
+                'verbose_name_plural': 'Outbox Events',
+                'ordering': ('id',),
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.0.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_friendship', '0005_outboxevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeferredSignal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signal', models.CharField(max_length=40)),
+                ('payload', models.BinaryField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Deferred Signal',
+                'verbose_name_plural': 'Deferred Signals',
+                'ordering': ('id',),
+            },
+        ),
+    ]
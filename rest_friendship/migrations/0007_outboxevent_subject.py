@@ -0,0 +1,26 @@
+# Generated by Django 2.0.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_friendship', '0006_deferredsignal'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='DeferredSignal',
+        ),
+        migrations.AddField(
+            model_name='outboxevent',
+            name='subject',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='outboxevent',
+            name='type',
+            field=models.CharField(choices=[('request_created', 'Friendship request created'), ('request_accepted', 'Friendship request accepted'), ('request_rejected', 'Friendship request rejected'), ('request_canceled', 'Friendship request canceled'), ('request_viewed', 'Friendship request viewed'), ('friendship_removed', 'Friendship removed'), ('follow_created', 'Follow created'), ('follow_removed', 'Follow removed')], max_length=20),
+        ),
+    ]
@@ -1,22 +1,47 @@
 from __future__ import unicode_literals
 
-from django.core.cache import cache
+import logging
+import time
+import uuid
+from array import array
+from bisect import bisect_left
+
+from django.apps import apps
+from django.core.cache import caches
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Q
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
+from rest_friendship import dispatch
 from rest_friendship.exceptions import AlreadyExistsError, AlreadyFriendsError
 from rest_friendship.signals import (
     friendship_request_created, friendship_request_rejected,
     friendship_request_canceled,
     friendship_request_viewed, friendship_request_accepted,
     friendship_removed, follower_created, follower_removed,
-    followee_created, followee_removed, following_created, following_removed
+    followee_created, followee_removed, following_created, following_removed, outbox_events
 )
 from rest_profile.models import Profile
 
+logger = logging.getLogger(__name__)
+
+
+class FriendshipCache(object):
+    """
+    Proxy to the cache alias configured in REST_FRIENDSHIP['CACHE_ALIAS']
+    """
+
+    def __getattr__(self, name):
+        return getattr(caches[apps.get_app_config('rest_friendship').cache_alias], name)
+
+
+cache = FriendshipCache()
+
 CACHE_TYPES = {
     'friends': 'f-%s',
     'followers': 'fo-%s',
@@ -29,12 +54,13 @@ CACHE_TYPES = {
     'rejected_requests': 'frj-%s',
     'unrejected_requests': 'frur-%s',
     'unrejected_request_count': 'frurc-%s',
+    'sent_request_count': 'sfrc-%s',
+    'follower_count': 'foc-%s',
+    'following_count': 'flc-%s',
 }
 
 BUST_CACHES = {
     'friends': ['friends'],
-    'followers': ['followers'],
-    'following': ['following'],
     'requests': [
         'requests',
         'unread_requests',
@@ -44,24 +70,302 @@ BUST_CACHES = {
         'unrejected_requests',
         'unrejected_request_count',
     ],
-    'sent_requests': ['sent_requests'],
+    'sent_requests': ['sent_requests', 'sent_request_count'],
+    'followers': ['followers', 'follower_count'],
+    'following': ['following', 'following_count'],
 }
 
+# The bust group each cache type belongs to
+BUST_GROUPS = {k: type for type, bust_keys in BUST_CACHES.items() for k in bust_keys}
+
+
+def generation_key(type, user_pk):
+    """
+    Build the key holding the generation of a bust group
+    """
+    return 'ver-' + CACHE_TYPES[type] % user_pk
+
+
+def new_generation():
+    """
+    Generations are random so a lost or concurrently bumped generation
+    can't collide with a previous one. They start with their creation
+    time so they double as version stamps for conditional requests.
+    """
+    return '%08x%s' % (int(time.time()), uuid.uuid4().hex[:8])
+
+
+def generation_time(generation):
+    """
+    Return the creation timestamp of a generation
+    """
+    return int(generation[:8], 16)
+
+
+def cache_generation(type, user_pk):
+    """
+    Return the current generation of a bust group
+    """
+    key = generation_key(type, user_pk)
+    generation = cache.get(key)
+
+    if generation is None:
+        generation = new_generation()
+        cache.add(key, generation, None)
+        generation = cache.get(key, generation)
+
+    return generation
+
+
+def cache_generations(busts):
+    """
+    Return the current generations of several (type, user_pk) bust groups
+    in a single round trip
+    """
+    keys = [generation_key(type, user_pk) for type, user_pk in busts]
+    generations = cache.get_many(keys)
+    return [generations.get(key) or cache_generation(type, user_pk) for key, (type, user_pk) in zip(keys, busts)]
+
+
+def profile_pk(user):
+    """
+    Return the primary key of the profile of a user, cached for good as it
+    never changes
+    """
+    key = 'profile-pk-%s' % user.pk
+    pk = cache.get(key)
+
+    if pk is None:
+        pk = Profile.objects.values_list('pk', flat=True).get(owner=user)
+        cache.set(key, pk, None)
+
+    return pk
+
 
 def cache_key(type, user_pk):
     """
     Build the cache key for a particular type of cached value
     """
-    return CACHE_TYPES[type] % user_pk
+    return '%s-%s' % (CACHE_TYPES[type] % user_pk, cache_generation(BUST_GROUPS[type], user_pk))
 
 
 def bust_cache(type, user_pk):
     """
-    Bust our cache for a given type, can bust multiple caches
+    Bust our cache for a given type, can bust multiple caches: the keys
+    of the group move to a new generation and the old ones expire
     """
-    bust_keys = BUST_CACHES[type]
-    keys = [CACHE_TYPES[k] % user_pk for k in bust_keys]
-    cache.delete_many(keys)
+    bust_caches([(type, user_pk)])
+
+
+def bust_caches(busts):
+    """
+    Bust several (type, user_pk) caches in a single round trip
+    """
+    generation = new_generation()
+    cache.set_many({generation_key(type, user_pk): generation for type, user_pk in busts}, None)
+
+
+# Per-user outcomes of the bulk operations
+CREATED = 'created'
+REMOVED = 'removed'
+ALREADY_EXISTS = 'already_exists'
+ALREADY_FRIENDS = 'already_friends'
+DOES_NOT_EXIST = 'does_not_exist'
+SELF = 'self'
+
+
+def bulk_create_ignore_conflicts(model, objs):
+    """
+    bulk_create skipping the rows a concurrent request inserted first,
+    return the objects actually created
+    """
+    try:
+        with transaction.atomic():
+            return model.objects.bulk_create(objs)
+    except IntegrityError:
+        created = []
+        for obj in objs:
+            try:
+                with transaction.atomic():
+                    obj.save(force_insert=True)
+            except IntegrityError:
+                continue
+            created.append(obj)
+        return created
+
+
+def insert_or_ignore(obj, unless=None, params=(), event=None):
+    """
+    Insert obj in a single INSERT .. ON CONFLICT DO NOTHING statement, relying
+    on the unique constraints instead of a prior SELECT. The insert is also
+    skipped when the `unless` EXISTS subquery matches. An `event` given as
+    (type, actor_field, target_field) is recorded to the outbox, with the new
+    row as subject, by the same statement when the row is inserted. Return True and set obj.pk when the
+    row was inserted.
+    """
+    meta = obj._meta
+    qn = connection.ops.quote_name
+    fields, values = [], []
+    for field in meta.concrete_fields:
+        value = None if isinstance(field, models.AutoField) else field.pre_save(obj, True)
+        # Leave NULLs to the column default, they would be untyped in the SELECT list
+        if value is not None:
+            fields.append(field)
+            values.append(field.get_db_prep_save(value, connection))
+    sql = 'INSERT INTO %s (%s) SELECT %s' % (qn(meta.db_table), ', '.join(qn(field.column) for field in fields),
+                                            ', '.join(['%s'] * len(fields)))
+    if unless is not None:
+        sql += ' WHERE NOT EXISTS (%s)' % unless
+    sql += ' ON CONFLICT DO NOTHING RETURNING %s' % qn(meta.pk.column)
+    params = values + list(params)
+    if event is not None:
+        type, actor, target = event
+        actor, target = qn(meta.get_field(actor).column), qn(meta.get_field(target).column)
+        pk = qn(meta.pk.column)
+        sql = ('WITH inserted AS (%s, %s, %s), recorded AS (INSERT INTO %s (type, actor, target, subject, created) '
+               'SELECT %%s, %s, %s, %s, %%s FROM inserted) SELECT %s FROM inserted') % (
+            sql, actor, target, qn(OutboxEvent._meta.db_table), actor, target, pk, pk)
+        params += [type, timezone.now()]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    if row is None:
+        return False
+    obj.pk = row[0]
+    obj._state.adding = False
+    obj._state.db = connection.alias
+    return True
+
+
+def record(type, events):
+    """
+    Append (actor_pk, target_pk, subject_pk) events of a type to the outbox,
+    to be called in the transaction of the write
+    """
+    if events:
+        OutboxEvent.objects.bulk_create([OutboxEvent(type=type, actor=actor, target=target, subject=subject)
+                                         for actor, target, subject in events])
+
+
+def update_counts(field, profile_ids, delta=1):
+    """
+    Atomically shift a denormalized Profile counter of the given profiles,
+    decrements stop at 0
+    """
+    if profile_ids and delta:
+        value = F(field) + delta if delta > 0 else Greatest(F(field) + delta, 0)
+        Profile.objects.filter(pk__in=list(profile_ids)).update(**{field: value})
+
+
+def count_subquery(qs, field):
+    """
+    Correlated count of the rows of qs whose `field` is the outer profile
+    """
+    qs = qs.filter(**{field: OuterRef('pk')}).order_by().values(field)
+    return Coalesce(Subquery(qs.annotate(count=Count('pk')).values('count'),
+                             output_field=models.PositiveIntegerField()), 0)
+
+
+def recount(profiles=None):
+    """
+    Recompute the denormalized Profile counters from the relationship
+    tables, for the given profiles or all of them
+    """
+    qs = Profile.objects.all() if profiles is None else Profile.objects.filter(pk__in=profiles)
+    return qs.update(
+        friend_count=count_subquery(Friend.objects.all(), 'to_user'),
+        follower_count=count_subquery(Follow.objects.all(), 'followee'),
+        following_count=count_subquery(Follow.objects.all(), 'follower'),
+    )
+
+
+def relationships(viewer, profile_ids):
+    """
+    Return the relationship flags of viewer with each of the given profiles,
+    by profile id, in at most three queries: one per relationship table,
+    skipped when the viewer's cached id arrays already answer it
+    """
+    profile_ids = set(profile_ids)
+    statuses = {pk: {'friends': False, 'following': False, 'followed_by': False,
+                     'request_sent': False, 'request_received': False} for pk in profile_ids}
+    if not profile_ids:
+        return statuses
+
+    friend_ids = cache.get(cache_key('friends', viewer.pk))
+    if friend_ids is None:
+        friend_ids = Friend.objects.filter(to_user=viewer, from_user_id__in=profile_ids) \
+            .values_list('from_user_id', flat=True)
+    else:
+        friend_ids = [pk for pk in profile_ids if contains_id(friend_ids, pk)]
+    for pk in friend_ids:
+        statuses[pk]['friends'] = True
+
+    following_ids = cache.get(cache_key('following', viewer.pk))
+    follower_ids = cache.get(cache_key('followers', viewer.pk))
+    if following_ids is None or follower_ids is None:
+        follows = Follow.objects.filter(
+            Q(follower=viewer, followee_id__in=profile_ids) |
+            Q(followee=viewer, follower_id__in=profile_ids)
+        ).values_list('follower_id', 'followee_id')
+    else:
+        follows = [(viewer.pk, pk) for pk in profile_ids if contains_id(following_ids, pk)] + \
+                  [(pk, viewer.pk) for pk in profile_ids if contains_id(follower_ids, pk)]
+    for follower_id, followee_id in follows:
+        if follower_id == viewer.pk:
+            statuses[followee_id]['following'] = True
+        else:
+            statuses[follower_id]['followed_by'] = True
+
+    requests = FriendshipRequest.objects.filter(
+        Q(from_user=viewer, to_user_id__in=profile_ids) |
+        Q(to_user=viewer, from_user_id__in=profile_ids)
+    ).values_list('from_user_id', 'to_user_id')
+    for from_user_id, to_user_id in requests:
+        if from_user_id == viewer.pk:
+            statuses[to_user_id]['request_sent'] = True
+        else:
+            statuses[from_user_id]['request_received'] = True
+
+    return statuses
+
+
+# Fields of the lightweight profile lists
+PROFILE_PROJECTION = ('id', 'pseudo', 'img')
+
+
+def cached_profiles(type, user, join, projection=False):
+    """
+    Load the profiles of a cached id array: by primary key when the ids are
+    cached, otherwise with a single joined query that also fills the cache.
+    With projection, return dicts of the PROFILE_PROJECTION fields instead.
+    """
+    key = cache_key(type, user.pk)
+    ids = cache.get(key)
+
+    qs = Profile.objects.filter(**join) if ids is None else Profile.objects.filter(pk__in=list(ids))
+    profiles = list(qs.values(*PROFILE_PROJECTION) if projection else qs)
+
+    if ids is None:
+        cache.set(key, pack_ids(profile['id'] if projection else profile.pk for profile in profiles))
+
+    return profiles
+
+
+def pack_ids(ids):
+    """
+    Pack ids into a sorted array of 64 bits integers, compact to cache
+    and searchable with a binary search
+    """
+    return array('q', sorted(ids))
+
+
+def contains_id(ids, pk):
+    """
+    O(log n) membership test on an array built by `pack_ids`
+    """
+    i = bisect_left(ids, pk)
+    return i < len(ids) and ids[i] == pk
 
 
 class FriendshipRequest(models.Model):
@@ -79,85 +383,109 @@ class FriendshipRequest(models.Model):
         verbose_name = _('Friendship Request')
         verbose_name_plural = _('Friendship Requests')
         unique_together = ('from_user', 'to_user')
+        indexes = [
+            models.Index(fields=['to_user', 'created'], name='friendreq_to_created_idx'),
+            models.Index(fields=['from_user', 'created'], name='friendreq_from_created_idx'),
+        ]
 
     def __str__(self):
         return "User #%s friendship requested #%s" % (self.from_user_id, self.to_user_id)
 
     def accept(self):
         """ Accept this friendship request """
-        Friend.objects.create(
-            from_user=self.from_user,
-            to_user=self.to_user
-        )
-
-        Friend.objects.create(
-            from_user=self.to_user,
-            to_user=self.from_user
-        )
-
-        friendship_request_accepted.send(
+        from_user_id, to_user_id = self.from_user_id, self.to_user_id
+
+        with transaction.atomic():
+            Friend.objects.bulk_create([
+                Friend(from_user_id=from_user_id, to_user_id=to_user_id),
+                Friend(from_user_id=to_user_id, to_user_id=from_user_id),
+            ])
+            update_counts('friend_count', [from_user_id, to_user_id])
+            record(OutboxEvent.REQUEST_ACCEPTED, [(to_user_id, from_user_id, self.pk)])
+
+            # Delete this request and any reverse request
+            FriendshipRequest.objects.filter(
+                Q(from_user_id=from_user_id, to_user_id=to_user_id) |
+                Q(from_user_id=to_user_id, to_user_id=from_user_id)
+            ).delete()
+
+        bust_caches([
+            # Bust requests cache - request is deleted
+            ('requests', to_user_id),
+            ('sent_requests', from_user_id),
+            # Bust reverse requests cache - reverse request might be deleted
+            ('requests', from_user_id),
+            ('sent_requests', to_user_id),
+            # Bust friends cache - new friends added
+            ('friends', to_user_id),
+            ('friends', from_user_id),
+        ])
+
+        dispatch.send(
+            friendship_request_accepted,
             sender=self,
             from_user=self.from_user,
             to_user=self.to_user
         )
 
-        self.delete()
-
-        # Delete any reverse requests
-        FriendshipRequest.objects.filter(
-            from_user=self.to_user,
-            to_user=self.from_user
-        ).delete()
-
-        # Bust requests cache - request is deleted
-        bust_cache('requests', self.to_user.pk)
-        bust_cache('sent_requests', self.from_user.pk)
-        # Bust reverse requests cache - reverse request might be deleted
-        bust_cache('requests', self.from_user.pk)
-        bust_cache('sent_requests', self.to_user.pk)
-        # Bust friends cache - new friends added
-        bust_cache('friends', self.to_user.pk)
-        bust_cache('friends', self.from_user.pk)
-
         return True
 
     def reject(self):
         """ reject this friendship request """
         self.rejected = timezone.now()
-        self.save()
-        friendship_request_rejected.send(sender=self)
-        bust_cache('requests', self.to_user.pk)
+        with transaction.atomic():
+            self.save()
+            record(OutboxEvent.REQUEST_REJECTED, [(self.to_user_id, self.from_user_id, self.pk)])
+        dispatch.send(friendship_request_rejected, sender=self)
+        bust_caches([('requests', self.to_user_id), ('sent_requests', self.from_user_id)])
 
     def cancel(self):
         """ cancel this friendship request """
-        self.delete()
-        friendship_request_canceled.send(sender=self)
+        with transaction.atomic():
+            record(OutboxEvent.REQUEST_CANCELED, [(self.from_user_id, self.to_user_id, self.pk)])
+            self.delete()
+        dispatch.send(friendship_request_canceled, sender=self)
         bust_cache('requests', self.to_user.pk)
         bust_cache('sent_requests', self.from_user.pk)
         return True
 
     def mark_viewed(self):
         self.viewed = timezone.now()
-        friendship_request_viewed.send(sender=self)
-        self.save()
-        bust_cache('requests', self.to_user.pk)
+        with transaction.atomic():
+            self.save()
+            record(OutboxEvent.REQUEST_VIEWED, [(self.to_user_id, self.from_user_id, self.pk)])
+        dispatch.send(friendship_request_viewed, sender=self)
+        bust_caches([('requests', self.to_user_id), ('sent_requests', self.from_user_id)])
         return True
 
 
 class FriendshipManager(models.Manager):
     """ Friendship manager """
 
-    def friends(self, user):
-        """ Return a list of all friends """
+    def friend_ids(self, user):
+        """ Return the sorted ids of all friends """
         key = cache_key('friends', user.pk)
-        friends = cache.get(key)
+        friend_ids = cache.get(key)
+
+        if friend_ids is None:
+            friend_ids = pack_ids(Friend.objects.filter(to_user=user).values_list('from_user_id', flat=True))
+            cache.set(key, friend_ids)
 
-        if friends is None:
-            qs = Friend.objects.select_related('from_user', 'to_user').filter(to_user=user).all()
-            friends = [u.from_user for u in qs]
-            cache.set(key, friends)
+        return friend_ids
 
-        return friends
+    def mutual_friend_ids(self, user, other):
+        """
+        Return the sorted ids of the friends user and other have in common,
+        looking up the smallest cached friend list into the largest one
+        """
+        ids, other_ids = self.friend_ids(user), self.friend_ids(other)
+        if len(ids) > len(other_ids):
+            ids, other_ids = other_ids, ids
+        return array('q', (pk for pk in ids if contains_id(other_ids, pk)))
+
+    def friends(self, user, projection=False):
+        """ Return a list of all friends """
+        return cached_profiles('friends', user, {'_unused_friend_relation__to_user': user}, projection)
 
     def requests(self, user):
         """ Return a list of friendship requests """
@@ -254,6 +582,28 @@ class FriendshipManager(models.Manager):
 
         return unrejected_requests
 
+    def counts(self, user):
+        """
+        Return the unread requests, pending sent requests, followers and
+        following counts of user, read from the cache or computed together
+        in a single query
+        """
+        types = ('unread_request_count', 'sent_request_count', 'follower_count', 'following_count')
+        generations = cache_generations([(BUST_GROUPS[type], user.pk) for type in types])
+        keys = {type: '%s-%s' % (CACHE_TYPES[type] % user.pk, generation)
+                for type, generation in zip(types, generations)}
+        cached = cache.get_many(list(keys.values()))
+
+        if len(cached) < len(keys):
+            values = Profile.objects.filter(pk=user.pk).annotate(
+                unread_request_count=count_subquery(FriendshipRequest.objects.filter(viewed__isnull=True), 'to_user'),
+                sent_request_count=count_subquery(FriendshipRequest.objects.filter(rejected__isnull=True), 'from_user'),
+            ).values(*types).get()
+            cached = {keys[type]: values[type] for type in types}
+            cache.set_many(cached)
+
+        return {type: cached[keys[type]] for type in types}
+
     def unrejected_request_count(self, user):
         """ Return a count of unrejected friendship requests """
         key = cache_key('unrejected_request_count', user.pk)
@@ -272,29 +622,137 @@ class FriendshipManager(models.Manager):
         if from_user == to_user:
             raise ValidationError("Users cannot be friends with themselves")
 
-        if self.are_friends(from_user, to_user):
+        # Only trust the cache to answer without touching the database
+        friend_ids = cache.get(cache_key('friends', from_user.pk))
+        if friend_ids is not None and contains_id(friend_ids, to_user.pk):
             raise AlreadyFriendsError("Users are already friends")
 
-        if message is None:
-            message = ''
+        request = FriendshipRequest(from_user=from_user, to_user=to_user, message=message or '')
+        friends = 'SELECT 1 FROM %s WHERE to_user_id = %%s AND from_user_id = %%s' % Friend._meta.db_table
+        event = (OutboxEvent.REQUEST_CREATED, 'from_user', 'to_user')
+        if not insert_or_ignore(request, unless=friends, params=[from_user.pk, to_user.pk], event=event):
+            if self.are_friends(from_user, to_user):
+                raise AlreadyFriendsError("Users are already friends")
+            raise AlreadyExistsError("Friendship already requested")
 
-        request, created = FriendshipRequest.objects.get_or_create(
-            from_user=from_user,
-            to_user=to_user,
-        )
+        bust_caches([('requests', to_user.pk), ('sent_requests', from_user.pk)])
+        dispatch.send(friendship_request_created, sender=request)
 
-        if created is False:
-            raise AlreadyExistsError("Friendship already requested")
+        return request
 
-        if message:
-            request.message = message
-            request.save()
+    def add_friends(self, from_user, to_users, message=None):
+        """
+        Create friendship requests to several users at once, return a dict
+        of outcomes by user pk
+        """
+        friends = set(Friend.objects.filter(to_user=from_user, from_user__in=to_users)
+                      .values_list('from_user_id', flat=True))
+        requested = set(FriendshipRequest.objects.filter(from_user=from_user, to_user__in=to_users)
+                        .values_list('to_user_id', flat=True))
+
+        outcomes = {}
+        requests = []
+        for to_user in to_users:
+            if to_user.pk in outcomes:
+                continue
+            if to_user == from_user:
+                outcomes[to_user.pk] = SELF
+            elif to_user.pk in friends:
+                outcomes[to_user.pk] = ALREADY_FRIENDS
+            elif to_user.pk in requested:
+                outcomes[to_user.pk] = ALREADY_EXISTS
+            else:
+                outcomes[to_user.pk] = ALREADY_EXISTS
+                requests.append(FriendshipRequest(from_user=from_user, to_user=to_user, message=message or ''))
+
+        with transaction.atomic():
+            created = bulk_create_ignore_conflicts(FriendshipRequest, requests)
+            record(OutboxEvent.REQUEST_CREATED, [(from_user.pk, r.to_user_id, r.pk) for r in created])
+        if created:
+            bust_caches([('sent_requests', from_user.pk)] + [('requests', r.to_user_id) for r in created])
+        for request in created:
+            outcomes[request.to_user_id] = CREATED
+            dispatch.send(friendship_request_created, sender=request)
+
+        return outcomes
+
+    def accept_requests(self, user, request_ids=None):
+        """
+        Accept the given friendship requests to user, or all the unread and
+        unrejected ones, in a single transaction. Return the accepted requests.
+        """
+        with transaction.atomic():
+            # Only lock the requests, not the joined profiles, in a stable order against deadlocks
+            qs = FriendshipRequest.objects.select_for_update(of=('self',)).select_related(
+                'from_user', 'to_user').filter(to_user=user).order_by('pk')
+            if request_ids is None:
+                qs = qs.filter(viewed__isnull=True, rejected__isnull=True)
+            else:
+                qs = qs.filter(pk__in=request_ids)
+            requests = list(qs)
+            if not requests:
+                return []
+
+            from_user_ids = [request.from_user_id for request in requests]
+            friends = set(Friend.objects.filter(to_user=user, from_user_id__in=from_user_ids)
+                          .values_list('from_user_id', flat=True))
+            new_friend_ids = [from_user_id for from_user_id in from_user_ids if from_user_id not in friends]
+            Friend.objects.bulk_create([
+                friend
+                for from_user_id in new_friend_ids
+                for friend in (Friend(from_user_id=from_user_id, to_user_id=user.pk),
+                               Friend(from_user_id=user.pk, to_user_id=from_user_id))
+            ])
+            update_counts('friend_count', new_friend_ids)
+            update_counts('friend_count', [user.pk], len(new_friend_ids))
+            record(OutboxEvent.REQUEST_ACCEPTED, [(user.pk, r.from_user_id, r.pk) for r in requests])
+
+            # Delete the requests and any reverse request
+            FriendshipRequest.objects.filter(
+                Q(to_user=user, from_user_id__in=from_user_ids) |
+                Q(from_user=user, to_user_id__in=from_user_ids)
+            ).delete()
+
+        busts = [('requests', user.pk), ('sent_requests', user.pk), ('friends', user.pk)]
+        for from_user_id in from_user_ids:
+            busts += [('requests', from_user_id), ('sent_requests', from_user_id), ('friends', from_user_id)]
+        bust_caches(busts)
+
+        for request in requests:
+            dispatch.send(
+                friendship_request_accepted,
+                sender=request,
+                from_user=request.from_user,
+                to_user=request.to_user
+            )
 
-        bust_cache('requests', to_user.pk)
-        bust_cache('sent_requests', from_user.pk)
-        friendship_request_created.send(sender=request)
+        return requests
 
-        return request
+    def reject_requests(self, user, request_ids=None):
+        """
+        Reject the given friendship requests to user, or all the unread ones.
+        Return the rejected requests.
+        """
+        qs = FriendshipRequest.objects.filter(to_user=user, rejected__isnull=True)
+        if request_ids is None:
+            qs = qs.filter(viewed__isnull=True)
+        else:
+            qs = qs.filter(pk__in=request_ids)
+        requests = list(qs)
+        if not requests:
+            return []
+
+        rejected = timezone.now()
+        with transaction.atomic():
+            FriendshipRequest.objects.filter(pk__in=[request.pk for request in requests]).update(rejected=rejected)
+            record(OutboxEvent.REQUEST_REJECTED, [(user.pk, r.from_user_id, r.pk) for r in requests])
+        bust_caches([('requests', user.pk)] + [('sent_requests', request.from_user_id) for request in requests])
+
+        for request in requests:
+            request.rejected = rejected
+            dispatch.send(friendship_request_rejected, sender=request)
+
+        return requests
 
     def remove_friend(self, from_user, to_user):
         """ Destroy a friendship relationship """
@@ -305,12 +763,21 @@ class FriendshipManager(models.Manager):
             ).distinct().all()
 
             if qs:
-                friendship_removed.send(
-                    sender=qs[0],
+                friend = qs[0]
+                with transaction.atomic():
+                    # A concurrent removal may have deleted the rows since, only count our own delete
+                    deleted, _ = qs.delete()
+                    if deleted:
+                        update_counts('friend_count', [from_user.pk, to_user.pk], -1)
+                        record(OutboxEvent.FRIENDSHIP_REMOVED, [(from_user.pk, to_user.pk, friend.pk)])
+                if not deleted:
+                    return False
+                dispatch.send(
+                    friendship_removed,
+                    sender=friend,
                     from_user=from_user,
                     to_user=to_user
                 )
-                qs.delete()
                 bust_cache('friends', to_user.pk)
                 bust_cache('friends', from_user.pk)
                 return True
@@ -320,19 +787,16 @@ class FriendshipManager(models.Manager):
             return False
 
     def are_friends(self, user1, user2):
-        """ Are these two users friends? """
+        """ Are these two users friends? Smartly uses caches if exists """
         friends1 = cache.get(cache_key('friends', user1.pk))
+        if friends1 is not None:
+            return contains_id(friends1, user2.pk)
+
         friends2 = cache.get(cache_key('friends', user2.pk))
-        if friends1 and user2 in friends1:
-            return True
-        elif friends2 and user1 in friends2:
-            return True
-        else:
-            try:
-                Friend.objects.get(to_user=user1, from_user=user2)
-                return True
-            except Friend.DoesNotExist:
-                return False
+        if friends2 is not None:
+            return contains_id(friends2, user1.pk)
+
+        return Friend.objects.filter(to_user=user1, from_user=user2).exists()
 
 
 class Friend(models.Model):
@@ -347,6 +811,9 @@ class Friend(models.Model):
         verbose_name = _('Friend')
         verbose_name_plural = _('Friends')
         unique_together = ('from_user', 'to_user')
+        indexes = [
+            models.Index(fields=['to_user', 'created'], name='friend_to_created_idx'),
+        ]
 
     def __str__(self):
         return "User #%s is friends with #%s" % (self.to_user_id, self.from_user_id)
@@ -361,78 +828,150 @@ class Friend(models.Model):
 class FollowingManager(models.Manager):
     """ Following manager """
 
-    def followers(self, user):
-        """ Return a list of all followers """
+    def follower_ids(self, user):
+        """ Return the sorted ids of all followers """
         key = cache_key('followers', user.pk)
-        followers = cache.get(key)
+        follower_ids = cache.get(key)
 
-        if followers is None:
-            qs = Follow.objects.filter(followee=user).all()
-            followers = [u.follower for u in qs]
-            cache.set(key, followers)
+        if follower_ids is None:
+            follower_ids = pack_ids(Follow.objects.filter(followee=user).values_list('follower_id', flat=True))
+            cache.set(key, follower_ids)
 
-        return followers
+        return follower_ids
 
-    def following(self, user):
-        """ Return a list of all users the given user follows """
+    def following_ids(self, user):
+        """ Return the sorted ids of all users the given user follows """
         key = cache_key('following', user.pk)
-        following = cache.get(key)
+        following_ids = cache.get(key)
+
+        if following_ids is None:
+            following_ids = pack_ids(Follow.objects.filter(follower=user).values_list('followee_id', flat=True))
+            cache.set(key, following_ids)
 
-        if following is None:
-            qs = Follow.objects.filter(follower=user).all()
-            following = [u.followee for u in qs]
-            cache.set(key, following)
+        return following_ids
 
-        return following
+    def followers(self, user, projection=False):
+        """ Return a list of all followers """
+        return cached_profiles('followers', user, {'following__followee': user}, projection)
+
+    def following(self, user, projection=False):
+        """ Return a list of all users the given user follows """
+        return cached_profiles('following', user, {'followers__follower': user}, projection)
 
     def add_follower(self, follower, followee):
         """ Create 'follower' follows 'followee' relationship """
         if follower == followee:
             raise ValidationError("Users cannot follow themselves")
 
-        relation, created = Follow.objects.get_or_create(follower=follower, followee=followee)
+        relation = Follow(follower=follower, followee=followee)
+        with transaction.atomic():
+            if not insert_or_ignore(relation):
+                raise AlreadyExistsError("User '%s' already follows '%s'" % (follower, followee))
+            update_counts('following_count', [follower.pk])
+            update_counts('follower_count', [followee.pk])
+            record(OutboxEvent.FOLLOW_CREATED, [(follower.pk, followee.pk, relation.pk)])
 
-        if created is False:
-            raise AlreadyExistsError("User '%s' already follows '%s'" % (follower, followee))
+        dispatch.send(follower_created, sender=self, follower=follower)
+        dispatch.send(followee_created, sender=self, followee=followee)
+        dispatch.send(following_created, sender=self, following=relation)
 
-        follower_created.send(sender=self, follower=follower)
-        followee_created.send(sender=self, followee=followee)
-        following_created.send(sender=self, following=relation)
-
-        bust_cache('followers', followee.pk)
-        bust_cache('following', follower.pk)
+        bust_caches([('followers', followee.pk), ('following', follower.pk)])
 
         return relation
 
+    def add_followers(self, follower, followees):
+        """
+        Create 'follower' follows each of 'followees' relationships, return
+        a dict of outcomes by followee pk
+        """
+        existing = set(Follow.objects.filter(follower=follower, followee__in=followees)
+                       .values_list('followee_id', flat=True))
+
+        outcomes = {}
+        relations = []
+        for followee in followees:
+            if followee.pk in outcomes:
+                continue
+            if followee == follower:
+                outcomes[followee.pk] = SELF
+            else:
+                outcomes[followee.pk] = ALREADY_EXISTS
+                if followee.pk not in existing:
+                    relations.append(Follow(follower=follower, followee=followee))
+
+        with transaction.atomic():
+            created = bulk_create_ignore_conflicts(Follow, relations)
+            update_counts('following_count', [follower.pk], len(created))
+            update_counts('follower_count', [relation.followee_id for relation in created])
+            record(OutboxEvent.FOLLOW_CREATED, [(follower.pk, r.followee_id, r.pk) for r in created])
+        if created:
+            bust_caches([('following', follower.pk)] + [('followers', r.followee_id) for r in created])
+        for relation in created:
+            outcomes[relation.followee_id] = CREATED
+            dispatch.send(follower_created, sender=self, follower=follower)
+            dispatch.send(followee_created, sender=self, followee=relation.followee)
+            dispatch.send(following_created, sender=self, following=relation)
+
+        return outcomes
+
+    def remove_followers(self, follower, followees):
+        """
+        Remove 'follower' follows each of 'followees' relationships, return
+        a dict of outcomes by followee pk
+        """
+        with transaction.atomic():
+            # Locked, a concurrent removal waits and then no longer finds the relations we delete
+            relations = list(Follow.objects.select_for_update(of=('self',)).select_related('follower', 'followee')
+                             .filter(follower=follower, followee__in=followees).order_by('pk'))
+            if relations:
+                Follow.objects.filter(pk__in=[rel.pk for rel in relations]).delete()
+                update_counts('following_count', [follower.pk], -len(relations))
+                update_counts('follower_count', [rel.followee_id for rel in relations], -1)
+                record(OutboxEvent.FOLLOW_REMOVED, [(follower.pk, rel.followee_id, rel.pk) for rel in relations])
+        if relations:
+            bust_caches([('following', follower.pk)] + [('followers', rel.followee_id) for rel in relations])
+        for rel in relations:
+            dispatch.send(follower_removed, sender=rel, follower=rel.follower)
+            dispatch.send(followee_removed, sender=rel, followee=rel.followee)
+            dispatch.send(following_removed, sender=rel, following=rel)
+
+        removed = {rel.followee_id for rel in relations}
+        return {followee.pk: REMOVED if followee.pk in removed else DOES_NOT_EXIST for followee in followees}
+
     def remove_follower(self, follower, followee):
         """ Remove 'follower' follows 'followee' relationship """
         try:
             rel = Follow.objects.get(follower=follower, followee=followee)
-            follower_removed.send(sender=rel, follower=rel.follower)
-            followee_removed.send(sender=rel, followee=rel.followee)
-            following_removed.send(sender=rel, following=rel)
-            rel.delete()
+            with transaction.atomic():
+                # Unlike rel.delete(), keeps rel.pk for the receivers. A concurrent
+                # removal may have deleted it since, only count our own delete.
+                deleted, _ = Follow.objects.filter(pk=rel.pk).delete()
+                if deleted:
+                    update_counts('following_count', [follower.pk], -1)
+                    update_counts('follower_count', [followee.pk], -1)
+                    record(OutboxEvent.FOLLOW_REMOVED, [(follower.pk, followee.pk, rel.pk)])
+            if not deleted:
+                return False
             bust_cache('followers', followee.pk)
             bust_cache('following', follower.pk)
+            dispatch.send(follower_removed, sender=rel, follower=rel.follower)
+            dispatch.send(followee_removed, sender=rel, followee=rel.followee)
+            dispatch.send(following_removed, sender=rel, following=rel)
             return True
         except Follow.DoesNotExist:
             return False
 
     def follows(self, follower, followee):
         """ Does follower follow followee? Smartly uses caches if exists """
-        followers = cache.get(cache_key('following', follower.pk))
-        following = cache.get(cache_key('followers', followee.pk))
+        following = cache.get(cache_key('following', follower.pk))
+        if following is not None:
+            return contains_id(following, followee.pk)
 
-        if followers and followee in followers:
-            return True
-        elif following and follower in following:
-            return True
-        else:
-            try:
-                Follow.objects.get(follower=follower, followee=followee)
-                return True
-            except Follow.DoesNotExist:
-                return False
+        followers = cache.get(cache_key('followers', followee.pk))
+        if followers is not None:
+            return contains_id(followers, follower.pk)
+
+        return Follow.objects.filter(follower=follower, followee=followee).exists()
 
 
 class Follow(models.Model):
@@ -447,6 +986,10 @@ class Follow(models.Model):
         verbose_name = _('Following Relationship')
         verbose_name_plural = _('Following Relationships')
         unique_together = ('follower', 'followee')
+        indexes = [
+            models.Index(fields=['followee', 'created'], name='follow_followee_created_idx'),
+            models.Index(fields=['follower', 'created'], name='follow_follower_created_idx'),
+        ]
 
     def __str__(self):
         return "User #%s follows #%s" % (self.follower_id, self.followee_id)
@@ -456,3 +999,297 @@ class Follow(models.Model):
         if self.follower == self.followee:
             raise ValidationError("Users cannot follow themselves.")
         super(Follow, self).save(*args, **kwargs)
+
+
+class OutboxManager(models.Manager):
+    """ Outbox manager """
+
+    def drain(self, batch_size=500):
+        """
+        Deliver the oldest batch of pending events to the `outbox_events`
+        receivers, and send their signals with REST_FRIENDSHIP
+        ['DEFERRED_SIGNALS'] = 'outbox', then delete them, in one transaction.
+        When a receiver fails the events are delivered one at a time so only
+        the failing ones are kept, their attempts counted and, after
+        REST_FRIENDSHIP['OUTBOX_MAX_ATTEMPTS'], set aside as failed. Batches
+        locked by a concurrent consumer are skipped. Return the number of
+        events delivered.
+        """
+        with transaction.atomic():
+            qs = self.select_for_update(skip_locked=True).filter(failed__isnull=True)
+            events = list(qs.order_by('pk')[:batch_size])
+            if not events:
+                return 0
+
+            delivered, failed = [], []
+            if self.deliver(events):
+                delivered = events
+            elif len(events) == 1:
+                failed = events
+            else:
+                for event in events:
+                    (delivered if self.deliver([event]) else failed).append(event)
+
+            self.filter(pk__in=[event.pk for event in delivered]).delete()
+            if failed:
+                max_attempts = apps.get_app_config('rest_friendship').outbox_max_attempts
+                retried = self.filter(pk__in=[event.pk for event in failed])
+                retried.update(attempts=F('attempts') + 1)
+                retried.filter(attempts__gte=max_attempts).update(failed=timezone.now())
+        return len(delivered)
+
+    def deliver(self, events):
+        """
+        Send the events to their receivers in a savepoint, rolled back when
+        any of them fails. Errors are logged, return whether all succeeded.
+        """
+        sends = [(outbox_events, OutboxEvent, {'events': events})]
+        if apps.get_app_config('rest_friendship').deferred_signals == dispatch.OUTBOX:
+            sends += self.signals(events)
+
+        sid = transaction.savepoint()
+        for signal, sender, kwargs in sends:
+            errors = [(receiver, response) for receiver, response in signal.send_robust(sender=sender, **kwargs)
+                      if isinstance(response, Exception)]
+            for receiver, error in errors:
+                logger.error('Error in %r receiver of outbox events %s', receiver,
+                             ', '.join(str(event.pk) for event in events),
+                             exc_info=(type(error), error, error.__traceback__))
+            if errors:
+                transaction.savepoint_rollback(sid)
+                return False
+        transaction.savepoint_commit(sid)
+        return True
+
+    def signals(self, events):
+        """ The (signal, sender, kwargs) of the writes the events recorded, in order """
+        profiles = Profile.objects.in_bulk(list({pk for event in events for pk in (event.actor, event.target)}))
+        # The relations of a deleted profile went with it
+        return [send for event in events if event.actor in profiles and event.target in profiles
+                for send in event.signals(profiles)]
+
+    def retry_failed(self):
+        """ Put the failed events back in the outbox, return their number """
+        return self.filter(failed__isnull=False).update(failed=None, attempts=0)
+
+
+class OutboxEvent(models.Model):
+    """
+    Append-only feed of the social graph writes, recorded in the same
+    transaction as the write and drained by the `drain_outbox` command
+    """
+    REQUEST_CREATED = 'request_created'
+    REQUEST_ACCEPTED = 'request_accepted'
+    REQUEST_REJECTED = 'request_rejected'
+    REQUEST_CANCELED = 'request_canceled'
+    REQUEST_VIEWED = 'request_viewed'
+    FRIENDSHIP_REMOVED = 'friendship_removed'
+    FOLLOW_CREATED = 'follow_created'
+    FOLLOW_REMOVED = 'follow_removed'
+    TYPES = (
+        (REQUEST_CREATED, _('Friendship request created')),
+        (REQUEST_ACCEPTED, _('Friendship request accepted')),
+        (REQUEST_REJECTED, _('Friendship request rejected')),
+        (REQUEST_CANCELED, _('Friendship request canceled')),
+        (REQUEST_VIEWED, _('Friendship request viewed')),
+        (FRIENDSHIP_REMOVED, _('Friendship removed')),
+        (FOLLOW_CREATED, _('Follow created')),
+        (FOLLOW_REMOVED, _('Follow removed')),
+    )
+
+    type = models.CharField(max_length=20, choices=TYPES)
+    # Plain ids, the events outlive the profiles
+    actor = models.IntegerField()
+    target = models.IntegerField()
+    # The request or relation written, it may be deleted since
+    subject = models.IntegerField(blank=True, null=True)
+    created = models.DateTimeField(default=timezone.now)
+    # Failed deliveries, events failing too often are set aside until retried
+    attempts = models.PositiveSmallIntegerField(default=0)
+    failed = models.DateTimeField(blank=True, null=True)
+
+    objects = OutboxManager()
+
+    class Meta:
+        verbose_name = _('Outbox Event')
+        verbose_name_plural = _('Outbox Events')
+        ordering = ('id',)
+
+    def __str__(self):
+        return "%s: user #%s, user #%s" % (self.type, self.actor, self.target)
+
+    def signals(self, profiles):
+        """
+        Rebuild the (signal, sender, kwargs) the write sent from the ids and
+        the profiles by pk. The request or relation is rebuilt unsaved, it
+        may no longer exist.
+        """
+        actor, target = profiles[self.actor], profiles[self.target]
+        if self.type in (self.REQUEST_CREATED, self.REQUEST_CANCELED):
+            request = FriendshipRequest(pk=self.subject, from_user=actor, to_user=target)
+            signal = friendship_request_created if self.type == self.REQUEST_CREATED else friendship_request_canceled
+            return [(signal, request, {})]
+        if self.type == self.REQUEST_ACCEPTED:
+            request = FriendshipRequest(pk=self.subject, from_user=target, to_user=actor)
+            return [(friendship_request_accepted, request, {'from_user': target, 'to_user': actor})]
+        if self.type == self.REQUEST_REJECTED:
+            request = FriendshipRequest(pk=self.subject, from_user=target, to_user=actor, rejected=self.created)
+            return [(friendship_request_rejected, request, {})]
+        if self.type == self.REQUEST_VIEWED:
+            request = FriendshipRequest(pk=self.subject, from_user=target, to_user=actor, viewed=self.created)
+            return [(friendship_request_viewed, request, {})]
+        if self.type == self.FRIENDSHIP_REMOVED:
+            friend = Friend(pk=self.subject, from_user=actor, to_user=target)
+            return [(friendship_removed, friend, {'from_user': actor, 'to_user': target})]
+        relation = Follow(pk=self.subject, follower=actor, followee=target)
+        if self.type == self.FOLLOW_CREATED:
+            return [(follower_created, Follow.objects, {'follower': actor}),
+                    (followee_created, Follow.objects, {'followee': target}),
+                    (following_created, Follow.objects, {'following': relation})]
+        return [(follower_removed, relation, {'follower': actor}),
+                (followee_removed, relation, {'followee': target}),
+                (following_removed, relation, {'following': relation})]
+
+
+# Upsert the (user_id, candidate_id) pairs given as two arrays with their
+# number of mutual friends plus followees following the candidate
+REFRESH_SUGGESTIONS_SQL = """
+INSERT INTO {table} (user_id, candidate_id, mutual_count, updated)
+SELECT user_id, candidate_id, mutual_count, %s FROM (
+    SELECT pair.user_id, pair.candidate_id, (
+        SELECT count(*) FROM {friend} a JOIN {friend} b ON b.from_user_id = a.from_user_id
+        WHERE a.to_user_id = pair.user_id AND b.to_user_id = pair.candidate_id
+    ) + (
+        SELECT count(*) FROM {follow} a JOIN {follow} b ON b.follower_id = a.followee_id
+        WHERE a.follower_id = pair.user_id AND b.followee_id = pair.candidate_id
+    ) AS mutual_count
+    FROM unnest(%s::integer[], %s::integer[]) AS pair(user_id, candidate_id)
+) AS counted
+WHERE mutual_count > 0
+ON CONFLICT (user_id, candidate_id) DO UPDATE
+SET mutual_count = EXCLUDED.mutual_count, updated = EXCLUDED.updated
+"""
+
+# Delete the suggestions ranked after the top K of each given user
+TRIM_SUGGESTIONS_SQL = """
+DELETE FROM {table} WHERE id IN (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (
+            PARTITION BY user_id ORDER BY mutual_count DESC, updated DESC, id DESC
+        ) AS rank
+        FROM {table}
+        WHERE user_id = ANY(%s)
+    ) AS ranked
+    WHERE rank > %s
+)
+"""
+
+
+class SuggestionManager(models.Manager):
+    """ Friend-of-friend suggestions manager """
+
+    def suggestions(self, user, limit=None):
+        """
+        Return the best ranked suggestions for user, skipping the users
+        already friends with or followed by user
+        """
+        size = apps.get_app_config('rest_friendship').suggestions_size
+        qs = self.select_related('candidate__owner').filter(user=user).exclude(
+            candidate_id__in=Friend.objects.filter(to_user=user).values('from_user_id')
+        ).exclude(
+            candidate_id__in=Follow.objects.filter(follower=user).values('followee_id')
+        )
+        return list(qs[:min(limit or size, size)])
+
+    def refresh(self, pairs):
+        """
+        Recount the mutual connections of each (user_id, candidate_id) pair
+        from the friend and follow tables in a single upsert, then trim the
+        suggestions of the users involved to their top K. Counting instead
+        of incrementing keeps it right when events are handled together,
+        late or twice.
+        """
+        pairs = {(user_id, candidate_id) for user_id, candidate_id in pairs if user_id != candidate_id}
+        if not pairs:
+            return
+
+        user_ids, candidate_ids = zip(*pairs)
+        sql = REFRESH_SUGGESTIONS_SQL.format(table=self.model._meta.db_table, friend=Friend._meta.db_table,
+                                             follow=Follow._meta.db_table)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [timezone.now(), list(user_ids), list(candidate_ids)])
+            self.trim(set(user_ids))
+
+    def trim(self, user_ids):
+        """ Keep only the top K suggestions of each given user """
+        size = apps.get_app_config('rest_friendship').suggestions_size
+        with connection.cursor() as cursor:
+            cursor.execute(TRIM_SUGGESTIONS_SQL.format(table=self.model._meta.db_table), [list(user_ids), size])
+
+    def discard(self, user, other):
+        """ Forget the suggestions between two users who got connected """
+        self.filter(Q(user=user, candidate=other) | Q(user=other, candidate=user)).delete()
+
+
+class Suggestion(models.Model):
+    """
+    Precomputed second degree connection, ranked by number of mutual
+    connections then recency
+    """
+    user = models.ForeignKey(Profile, related_name='suggestions', on_delete=models.CASCADE)
+    candidate = models.ForeignKey(Profile, related_name='+', on_delete=models.CASCADE)
+    mutual_count = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(default=timezone.now)
+
+    objects = SuggestionManager()
+
+    class Meta:
+        verbose_name = _('Suggestion')
+        verbose_name_plural = _('Suggestions')
+        unique_together = ('user', 'candidate')
+        ordering = ('-mutual_count', '-updated', '-id')
+        indexes = [
+            models.Index(fields=['user', '-mutual_count', '-updated'], name='suggestion_user_rank_idx'),
+        ]
+
+    def __str__(self):
+        return "User #%s may know #%s" % (self.user_id, self.candidate_id)
+
+
+@receiver(pre_delete, sender=Profile)
+def discount_deleted_profile(sender, instance, **kwargs):
+    """
+    The relations of a deleted profile cascade without going through the
+    managers, shift the counters of the profiles on the other side
+    """
+    friend_ids = list(Friend.objects.filter(to_user=instance).values_list('from_user_id', flat=True))
+    follower_ids = list(Follow.objects.filter(followee=instance).values_list('follower_id', flat=True))
+    following_ids = list(Follow.objects.filter(follower=instance).values_list('followee_id', flat=True))
+    update_counts('friend_count', friend_ids, -1)
+    update_counts('following_count', follower_ids, -1)
+    update_counts('follower_count', following_ids, -1)
+    bust_caches([('friends', pk) for pk in friend_ids] + [('following', pk) for pk in follower_ids] +
+                [('followers', pk) for pk in following_ids])
+
+
+@receiver(friendship_request_accepted)
+def suggest_friends_of_friends(sender, from_user, to_user, **kwargs):
+    """ The friends of each new friend are second degree connections of the other """
+    Suggestion.objects.discard(from_user, to_user)
+    pairs = []
+    for user, friend in ((from_user, to_user), (to_user, from_user)):
+        friend_ids = Friend.objects.friend_ids(friend)
+        for pk in Friend.objects.friend_ids(user):
+            if pk != friend.pk and not contains_id(friend_ids, pk):
+                pairs += [(friend.pk, pk), (pk, friend.pk)]
+    Suggestion.objects.refresh(pairs)
+
+
+@receiver(following_created)
+def suggest_followees_of_followees(sender, following, **kwargs):
+    """ The users a new followee follows are second degree connections of the follower """
+    Suggestion.objects.filter(user_id=following.follower_id, candidate_id=following.followee_id).delete()
+    following_ids = Follow.objects.following_ids(following.follower)
+    Suggestion.objects.refresh((following.follower_id, pk) for pk in Follow.objects.following_ids(following.followee)
+                               if pk != following.followee_id and not contains_id(following_ids, pk))
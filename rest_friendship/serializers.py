@@ -1,7 +1,10 @@
+from datetime import datetime
+
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 
 from rest_framework_friendly_errors.mixins import SerializerErrorMessagesMixin
-from rest_friendship.models import Friend, FriendshipRequest, Follow
+from rest_friendship.models import Friend, FriendshipRequest, Follow, Suggestion, PROFILE_PROJECTION
 from rest_profile.models import Profile
 
 
@@ -39,3 +42,52 @@ class FollowSerializer(SerializerErrorMessagesMixin, serializers.HyperlinkedMode
     class Meta:
         model = Follow
         fields = "__all__"
+
+
+class SuggestionSerializer(SerializerErrorMessagesMixin, serializers.HyperlinkedModelSerializer):
+    candidate = serializers.HyperlinkedRelatedField(many=False, view_name='profile-detail', read_only=True)
+    username = serializers.ReadOnlyField(source='candidate.owner.username')
+
+    class Meta:
+        model = Suggestion
+        fields = ('candidate', 'username', 'mutual_count', 'updated')
+
+
+class CompactSerializer(serializers.BaseSerializer):
+    """
+    Read only representation of relationship `values()` rows, embedding a
+    summary of each related profile instead of an hyperlink
+    """
+    values = ('id', 'created')
+    relations = ()
+    datetime_field = serializers.DateTimeField()
+
+    @classmethod
+    def value_names(cls):
+        """ Names to pass to `values()` """
+        return list(cls.values) + ['%s__%s' % (relation, field)
+                                   for relation in cls.relations for field in PROFILE_PROJECTION]
+
+    def to_representation(self, row):
+        data = {}
+        for name in self.values:
+            value = row[name]
+            data[name] = self.datetime_field.to_representation(value) if isinstance(value, datetime) else value
+        for relation in self.relations:
+            profile = {field: row['%s__%s' % (relation, field)] for field in PROFILE_PROJECTION}
+            profile['img'] = default_storage.url(profile['img']) if profile['img'] else None
+            data[relation] = profile
+        return data
+
+
+class CompactFriendshipSerializer(CompactSerializer):
+    relations = ('from_user', 'to_user')
+
+
+class CompactFriendshipRequestSerializer(CompactSerializer):
+    values = ('id', 'created', 'message', 'rejected', 'viewed')
+    relations = ('from_user', 'to_user')
+
+
+class CompactFollowSerializer(CompactSerializer):
+    relations = ('follower', 'followee')
@@ -13,3 +13,4 @@ followee_created = Signal(providing_args=['followee'])
 followee_removed = Signal(providing_args=['followee'])
 following_created = Signal(providing_args=['following'])
 following_removed = Signal(providing_args=['following'])
+outbox_events = Signal(providing_args=['events'])
@@ -0,0 +1,97 @@
+import threading
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+
+from rest_friendship import dispatch
+from rest_friendship.models import Follow, Friend, OutboxEvent, cache
+from rest_friendship.signals import follower_created, friendship_request_accepted
+
+
+class DeferredSignalTests(TransactionTestCase):
+
+    def setUp(self):
+        self.bob = User.objects.create_user('bob', 'bob@bob.com', 'test').profile
+        self.steve = User.objects.create_user('steve', 'steve@steve.com', 'test').profile
+        self.received = []
+        follower_created.connect(self.receiver)
+        cache.clear()
+
+    def tearDown(self):
+        follower_created.disconnect(self.receiver)
+        cache.clear()
+
+    def receiver(self, sender, follower, **kwargs):
+        self.received.append((follower, threading.current_thread()))
+
+    def test_immediate(self):
+        Follow.objects.add_follower(self.bob, self.steve)
+        self.assertEqual(self.received, [(self.bob, threading.current_thread())])
+
+    @override_settings(REST_FRIENDSHIP={'DEFERRED_SIGNALS': True})
+    def test_deferred(self):
+        with transaction.atomic():
+            Follow.objects.add_follower(self.bob, self.steve)
+            # Nothing is sent before commit
+            self.assertEqual(self.received, [])
+        dispatch.wait()
+
+        self.assertEqual(len(self.received), 1)
+        follower, thread = self.received[0]
+        self.assertEqual(follower, self.bob)
+        self.assertNotEqual(thread, threading.current_thread())
+
+    @override_settings(REST_FRIENDSHIP={'DEFERRED_SIGNALS': True})
+    def test_rolled_back(self):
+        try:
+            with transaction.atomic():
+                Follow.objects.add_follower(self.bob, self.steve)
+                raise ValueError
+        except ValueError:
+            pass
+        dispatch.wait()
+        self.assertEqual(self.received, [])
+
+    @override_settings(REST_FRIENDSHIP={'DEFERRED_SIGNALS': dispatch.OUTBOX})
+    def test_outbox(self):
+        relation = Follow.objects.add_follower(self.bob, self.steve)
+        Follow.objects.remove_follower(self.bob, self.steve)
+        self.assertEqual(self.received, [])
+        # Only the ids of the write are stored
+        self.assertEqual(list(OutboxEvent.objects.values_list('type', 'actor', 'target', 'subject')), [
+            (OutboxEvent.FOLLOW_CREATED, self.bob.pk, self.steve.pk, relation.pk),
+            (OutboxEvent.FOLLOW_REMOVED, self.bob.pk, self.steve.pk, relation.pk),
+        ])
+
+        call_command('drain_outbox', stdout=StringIO())
+        self.assertEqual(self.received, [(self.bob, threading.current_thread())])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @override_settings(REST_FRIENDSHIP={'DEFERRED_SIGNALS': dispatch.OUTBOX})
+    def test_outbox_rebuilds_senders(self):
+        accepted = []
+
+        def receiver(sender, from_user, to_user, **kwargs):
+            accepted.append((sender.pk, sender.from_user, sender.to_user, from_user, to_user))
+        friendship_request_accepted.connect(receiver)
+        self.addCleanup(friendship_request_accepted.disconnect, receiver)
+
+        request = Friend.objects.add_friend(self.bob, self.steve)
+        request.accept()
+        self.assertEqual(accepted, [])
+
+        OutboxEvent.objects.drain()
+        self.assertEqual(accepted, [(request.pk, self.bob, self.steve, self.bob, self.steve)])
+
+    @override_settings(REST_FRIENDSHIP={'DEFERRED_SIGNALS': dispatch.OUTBOX})
+    def test_outbox_rolled_back(self):
+        try:
+            with transaction.atomic():
+                Follow.objects.add_follower(self.bob, self.steve)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(OutboxEvent.objects.exists())
@@ -0,0 +1,66 @@
+import threading
+
+from rest_friendship.events import CacheBroker, LocalBroker, get_broker, waiter_slot
+from rest_friendship.models import Friend, Follow
+from rest_friendship.tests.test_models import BaseTestCase
+
+
+class EventBrokerTests(BaseTestCase):
+
+    def check_broker(self, broker):
+        self.assertEqual(broker.last_id(1), 0)
+        self.assertEqual(broker.poll(1, 0, 0), [])
+
+        broker.publish(1, {'type': 'foo'})
+        broker.publish(1, {'type': 'bar'})
+        broker.publish(2, {'type': 'baz'})
+        self.assertEqual(broker.last_id(1), 2)
+        self.assertEqual(broker.poll(1, 0, 0), [{'type': 'foo', 'id': 1}, {'type': 'bar', 'id': 2}])
+        self.assertEqual(broker.poll(1, 1, 0), [{'type': 'bar', 'id': 2}])
+        self.assertEqual(broker.poll(1, 2, 0), [])
+        self.assertEqual(broker.poll(2, 0, 0), [{'type': 'baz', 'id': 1}])
+
+    def test_local_broker(self):
+        self.check_broker(LocalBroker())
+
+    def test_cache_broker(self):
+        self.check_broker(CacheBroker(interval=0.01))
+
+    def test_cache_broker_wakes_pollers(self):
+        broker, other = CacheBroker(interval=0.01), CacheBroker(interval=0.01)
+        since = broker.last_id(1)
+        # Published by this process or by another worker
+        for publisher in (broker, other):
+            timer = threading.Timer(0.05, publisher.publish, (1, {'type': 'foo'}))
+            timer.start()
+            events = broker.poll(1, since, 5)
+            timer.join()
+            self.assertEqual(events, [{'type': 'foo', 'id': since + 1}])
+            since += 1
+        self.assertEqual(dict(broker.waiters), {})
+
+    def test_waiter_slot(self):
+        with waiter_slot(1) as first, waiter_slot(1) as second:
+            self.assertTrue(first)
+            self.assertFalse(second)
+        with waiter_slot(1) as third:
+            self.assertTrue(third)
+
+    def test_signals(self):
+        bob, steve, amy = self.user_bob.profile, self.user_steve.profile, self.user_amy.profile
+        broker = get_broker()
+        since = {profile.pk: broker.last_id(profile.pk) for profile in (bob, steve, amy)}
+
+        request = Friend.objects.add_friend(bob, steve)
+        request.accept()
+        Follow.objects.add_follower(amy, bob)
+        Friend.objects.add_friend(amy, steve).cancel()
+
+        self.assertEqual([event['type'] for event in broker.poll(steve.pk, since[steve.pk], 0)],
+                         ['friendship_request_created', 'friendship_request_created',
+                          'friendship_request_canceled'])
+        self.assertEqual(broker.poll(bob.pk, since[bob.pk], 0), [
+            {'type': 'friendship_request_accepted', 'user': steve.pk, 'id': since[bob.pk] + 1},
+            {'type': 'following_created', 'user': amy.pk, 'id': since[bob.pk] + 2},
+        ])
+        self.assertEqual(broker.poll(amy.pk, since[amy.pk], 0), [])
@@ -1,12 +1,19 @@
+from io import StringIO
+
 from django.contrib.auth.models import User
-from django.core.cache import cache
+from django.core.cache import caches
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
 from django.db import IntegrityError
-from django.test import RequestFactory
+from django.test import RequestFactory, override_settings
 from rest_framework.test import APIClient, APITestCase
 
 from rest_friendship.exceptions import AlreadyExistsError, AlreadyFriendsError
-from rest_friendship.models import Friend, FriendshipRequest, Follow
+from rest_friendship.models import Friend, FriendshipRequest, Follow, OutboxEvent, Suggestion, bust_cache, cache, \
+    cache_key, contains_id, pack_ids, relationships, CREATED, REMOVED, ALREADY_EXISTS, ALREADY_FRIENDS, \
+    DOES_NOT_EXIST, SELF
+from rest_friendship.signals import outbox_events
+from rest_profile.models import Profile
 
 
 class BaseTestCase(APITestCase):
@@ -174,6 +181,29 @@ class FriendshipModelTests(BaseTestCase):
         with self.assertRaises(AlreadyFriendsError):
             req2 = Friend.objects.add_friend(self.user_bob.profile, self.user_steve.profile)
 
+    def test_add_friend_single_insert(self):
+        bob, steve = self.user_bob.profile, self.user_steve.profile
+        with self.assertNumQueries(1):
+            req = Friend.objects.add_friend(bob, steve, message='Hello')
+        self.assertIsNotNone(req.pk)
+        # The outbox event is recorded by the same statement
+        self.assertEqual(list(OutboxEvent.objects.values_list('type', 'actor', 'target')),
+                         [(OutboxEvent.REQUEST_CREATED, bob.pk, steve.pk)])
+        self.assertEqual(FriendshipRequest.objects.get(pk=req.pk).message, 'Hello')
+
+        with self.assertRaises(AlreadyExistsError):
+            Friend.objects.add_friend(bob, steve)
+
+        req.accept()
+        Friend.objects.friend_ids(bob)
+        with self.assertNumQueries(0):
+            with self.assertRaises(AlreadyFriendsError):
+                Friend.objects.add_friend(bob, steve)
+        cache.clear()
+        with self.assertRaises(AlreadyFriendsError):
+            Friend.objects.add_friend(steve, bob)
+        self.assertEqual(FriendshipRequest.objects.count(), 0)
+
     def test_multiple_friendship_requests(self):
         """ Ensure multiple friendship requests are handled properly """
         # Bob wants to be friends with Steve
@@ -203,6 +233,48 @@ class FriendshipModelTests(BaseTestCase):
         self.assertEqual(FriendshipRequest.objects.filter(from_user=self.user_steve.profile).count(), 0)
         self.assertEqual(FriendshipRequest.objects.filter(to_user=self.user_bob.profile).count(), 0)
 
+    def test_accept_is_atomic(self):
+        req = Friend.objects.add_friend(self.user_bob.profile, self.user_steve.profile)
+        Friend.objects.create(from_user=self.user_steve.profile, to_user=self.user_bob.profile)
+
+        with self.assertRaises(IntegrityError):
+            req.accept()
+
+        # Nothing was half-done
+        self.assertEqual(Friend.objects.filter(from_user=self.user_bob.profile).count(), 0)
+        self.assertEqual(FriendshipRequest.objects.filter(pk=req.pk).count(), 1)
+
+    def test_accept_reject_requests(self):
+        bob, steve, susan, amy = (self.user_bob.profile, self.user_steve.profile, self.user_susan.profile,
+                                  self.user_amy.profile)
+        req1 = Friend.objects.add_friend(steve, bob)
+        req2 = Friend.objects.add_friend(susan, bob)
+        req3 = Friend.objects.add_friend(amy, bob)
+        Friend.objects.add_friend(bob, susan)
+        self.assertEqual(len(Friend.objects.requests(bob)), 3)
+
+        # Requests of other users are ignored
+        self.assertEqual(Friend.objects.accept_requests(steve, [req2.pk]), [])
+
+        accepted = Friend.objects.accept_requests(bob, [req1.pk, req2.pk])
+        self.assertEqual(sorted(request.pk for request in accepted), sorted([req1.pk, req2.pk]))
+        self.assertTrue(Friend.objects.are_friends(bob, steve))
+        self.assertTrue(Friend.objects.are_friends(susan, bob))
+        self.assertEqual(len(Friend.objects.friends(bob)), 2)
+        # The reverse request was deleted too
+        self.assertEqual(len(Friend.objects.sent_requests(bob)), 0)
+        self.assertEqual(len(Friend.objects.requests(bob)), 1)
+
+        rejected = Friend.objects.reject_requests(bob)
+        self.assertEqual([request.pk for request in rejected], [req3.pk])
+        self.assertEqual(len(Friend.objects.rejected_requests(bob)), 1)
+        self.assertEqual(len(Friend.objects.unrejected_requests(bob)), 0)
+        self.assertEqual(Friend.objects.reject_requests(bob), [])
+        self.assertFalse(Friend.objects.are_friends(bob, amy))
+        # Accepting all skips the rejected requests
+        self.assertEqual(Friend.objects.accept_requests(bob), [])
+        self.assertFalse(Friend.objects.are_friends(bob, amy))
+
     def test_multiple_calls_add_friend(self):
         """ Ensure multiple calls with same friends, but different message works as expected """
         req1 = Friend.objects.add_friend(self.user_bob.profile, self.user_steve.profile, message='Testing')
@@ -210,6 +282,128 @@ class FriendshipModelTests(BaseTestCase):
         with self.assertRaises(AlreadyExistsError):
             req2 = Friend.objects.add_friend(self.user_bob.profile, self.user_steve.profile, message='Foo Bar')
 
+    def test_add_friends(self):
+        bob, steve, susan, amy = (self.user_bob.profile, self.user_steve.profile, self.user_susan.profile,
+                                  self.user_amy.profile)
+        Friend.objects.add_friend(bob, steve).accept()
+        Friend.objects.add_friend(bob, susan)
+        self.assertEqual(len(Friend.objects.requests(amy)), 0)
+
+        outcomes = Friend.objects.add_friends(bob, [bob, steve, susan, amy, amy])
+        self.assertEqual(outcomes, {bob.pk: SELF, steve.pk: ALREADY_FRIENDS, susan.pk: ALREADY_EXISTS,
+                                    amy.pk: CREATED})
+        self.assertEqual(FriendshipRequest.objects.filter(from_user=bob, to_user=amy).count(), 1)
+        self.assertEqual(len(Friend.objects.requests(amy)), 1)
+        self.assertEqual(len(Friend.objects.sent_requests(bob)), 2)
+
+    def test_friend_ids(self):
+        Friend.objects.add_friend(self.user_bob.profile, self.user_steve.profile).accept()
+        Friend.objects.add_friend(self.user_amy.profile, self.user_steve.profile).accept()
+
+        friend_ids = Friend.objects.friend_ids(self.user_steve.profile)
+        self.assertEqual(list(friend_ids), sorted([self.user_bob.profile.pk, self.user_amy.profile.pk]))
+        self.assertEqual(cache.get(cache_key('friends', self.user_steve.profile.pk)), friend_ids)
+
+        # Membership is answered from the cached ids
+        with self.assertNumQueries(0):
+            self.assertTrue(Friend.objects.are_friends(self.user_steve.profile, self.user_amy.profile))
+            self.assertFalse(Friend.objects.are_friends(self.user_steve.profile, self.user_susan.profile))
+
+    def test_mutual_friend_ids(self):
+        bob, steve, susan, amy = (self.user_bob.profile, self.user_steve.profile, self.user_susan.profile,
+                                  self.user_amy.profile)
+        self.assertEqual(list(Friend.objects.mutual_friend_ids(bob, steve)), [])
+        Friend.objects.add_friend(bob, susan).accept()
+        Friend.objects.add_friend(bob, amy).accept()
+        Friend.objects.add_friend(steve, amy).accept()
+        self.assertEqual(list(Friend.objects.mutual_friend_ids(bob, steve)), [amy.pk])
+        self.assertEqual(list(Friend.objects.mutual_friend_ids(steve, bob)), [amy.pk])
+        Friend.objects.add_friend(steve, susan).accept()
+        self.assertEqual(list(Friend.objects.mutual_friend_ids(bob, steve)), sorted([susan.pk, amy.pk]))
+
+    def test_relationships(self):
+        bob, steve, susan, amy = (self.user_bob.profile, self.user_steve.profile, self.user_susan.profile,
+                                  self.user_amy.profile)
+        Friend.objects.add_friend(bob, steve).accept()
+        Friend.objects.add_friend(bob, susan)
+        Friend.objects.add_friend(amy, bob)
+        Follow.objects.add_follower(bob, steve)
+        Follow.objects.add_follower(amy, bob)
+        flags = lambda **kwargs: dict({'friends': False, 'following': False, 'followed_by': False,
+                                       'request_sent': False, 'request_received': False}, **kwargs)
+        expected = {
+            steve.pk: flags(friends=True, following=True),
+            susan.pk: flags(request_sent=True),
+            amy.pk: flags(followed_by=True, request_received=True),
+        }
+
+        cache.clear()
+        with self.assertNumQueries(3):
+            self.assertEqual(relationships(bob, [steve.pk, susan.pk, amy.pk]), expected)
+
+        Friend.objects.friend_ids(bob)
+        Follow.objects.follower_ids(bob)
+        Follow.objects.following_ids(bob)
+        with self.assertNumQueries(1):
+            self.assertEqual(relationships(bob, [steve.pk, susan.pk, amy.pk]), expected)
+
+    def test_counts(self):
+        bob, steve, susan, amy = (self.user_bob.profile, self.user_steve.profile, self.user_susan.profile,
+                                  self.user_amy.profile)
+        Friend.objects.add_friend(steve, bob)
+        Friend.objects.add_friend(susan, bob).mark_viewed()
+        Friend.objects.add_friend(bob, amy)
+        Follow.objects.add_follower(steve, bob)
+        cache.clear()
+
+        expected = {'unread_request_count': 1, 'sent_request_count': 1, 'follower_count': 1, 'following_count': 0}
+        with self.assertNumQueries(1):
+            self.assertEqual(Friend.objects.counts(bob), expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(Friend.objects.counts(bob), expected)
+
+        Follow.objects.add_follower(bob, amy)
+        Friend.objects.add_friend(amy, bob)
+        self.assertEqual(Friend.objects.counts(bob), {'unread_request_count': 2, 'sent_request_count': 1,
+                                                      'follower_count': 1, 'following_count': 1})
+
+    def test_cache_alias(self):
+        with override_settings(REST_FRIENDSHIP={'CACHE_ALIAS': 'social'}):
+            Friend.objects.friend_ids(self.user_bob.profile)
+            self.assertIsNotNone(caches['social'].get(cache_key('friends', self.user_bob.profile.pk)))
+            self.assertIsNone(caches['default'].get(cache_key('friends', self.user_bob.profile.pk)))
+            cache.clear()
+
+        with override_settings(REST_FRIENDSHIP={'CACHE_ALIAS': 'default'}):
+            Friend.objects.friend_ids(self.user_bob.profile)
+            self.assertIsNotNone(caches['default'].get(cache_key('friends', self.user_bob.profile.pk)))
+            cache.clear()
+
+    def test_bust_cache(self):
+        profile = self.user_bob.profile
+        requests_key = cache_key('requests', profile.pk)
+        count_key = cache_key('unread_request_count', profile.pk)
+        friends_key = cache_key('friends', profile.pk)
+        self.assertEqual(Friend.objects.unread_request_count(profile), 0)
+
+        # A single bust moves every key of the group to a new generation
+        with self.assertNumQueries(0):
+            bust_cache('requests', profile.pk)
+        self.assertNotEqual(cache_key('requests', profile.pk), requests_key)
+        self.assertNotEqual(cache_key('unread_request_count', profile.pk), count_key)
+        self.assertEqual(cache_key('friends', profile.pk), friends_key)
+
+        Friend.objects.add_friend(self.user_steve.profile, profile)
+        self.assertEqual(Friend.objects.unread_request_count(profile), 1)
+
+    def test_pack_ids(self):
+        ids = pack_ids([5, 1, 3])
+        self.assertEqual(list(ids), [1, 3, 5])
+        self.assertTrue(contains_id(ids, 3))
+        self.assertFalse(contains_id(ids, 4))
+        self.assertFalse(contains_id(ids, 6))
+        self.assertFalse(contains_id(pack_ids([]), 1))
+
     def test_following(self):
         # Bob follows Steve
         req1 = Follow.objects.add_follower(self.user_bob.profile, self.user_steve.profile)
@@ -239,3 +433,255 @@ class FriendshipModelTests(BaseTestCase):
 
         with self.assertRaises(ValidationError):
             Follow.objects.create(follower=self.user_bob.profile, followee=self.user_bob.profile)
+
+    def test_following_ids(self):
+        Follow.objects.add_follower(self.user_bob.profile, self.user_steve.profile)
+        Follow.objects.add_follower(self.user_amy.profile, self.user_steve.profile)
+
+        self.assertEqual(list(Follow.objects.follower_ids(self.user_steve.profile)),
+                         sorted([self.user_bob.profile.pk, self.user_amy.profile.pk]))
+        self.assertEqual(list(Follow.objects.following_ids(self.user_bob.profile)), [self.user_steve.profile.pk])
+
+        with self.assertNumQueries(0):
+            self.assertTrue(Follow.objects.follows(self.user_amy.profile, self.user_steve.profile))
+            self.assertFalse(Follow.objects.follows(self.user_susan.profile, self.user_steve.profile))
+
+    def test_followers_loaders(self):
+        bob, steve, amy = self.user_bob.profile, self.user_steve.profile, self.user_amy.profile
+        Follow.objects.add_follower(bob, steve)
+        Follow.objects.add_follower(amy, steve)
+        cache.clear()
+
+        # A cold cache costs a single joined query, and warms the id array
+        with self.assertNumQueries(1):
+            self.assertEqual(sorted(p.pk for p in Follow.objects.followers(steve)), sorted([bob.pk, amy.pk]))
+        with self.assertNumQueries(0):
+            self.assertTrue(Follow.objects.follows(amy, steve))
+        with self.assertNumQueries(1):
+            self.assertEqual(Follow.objects.following(bob), [steve])
+
+        followers = Follow.objects.followers(steve, projection=True)
+        self.assertEqual(sorted(followers, key=lambda p: p['id']),
+                         sorted([{'id': p.pk, 'pseudo': p.pseudo, 'img': p.img.name or None} for p in (bob, amy)],
+                                key=lambda p: p['id']))
+
+    def test_bulk_followers(self):
+        bob, steve, susan = self.user_bob.profile, self.user_steve.profile, self.user_susan.profile
+        Follow.objects.add_follower(bob, steve)
+        self.assertEqual(len(Follow.objects.followers(susan)), 0)
+
+        outcomes = Follow.objects.add_followers(bob, [bob, steve, susan])
+        self.assertEqual(outcomes, {bob.pk: SELF, steve.pk: ALREADY_EXISTS, susan.pk: CREATED})
+        self.assertTrue(Follow.objects.follows(bob, susan))
+        self.assertEqual(Follow.objects.followers(susan), [bob])
+        self.assertEqual(len(Follow.objects.following(bob)), 2)
+
+        outcomes = Follow.objects.remove_followers(bob, [steve, susan, self.user_amy.profile])
+        self.assertEqual(outcomes, {steve.pk: REMOVED, susan.pk: REMOVED, self.user_amy.profile.pk: DOES_NOT_EXIST})
+        self.assertEqual(Follow.objects.following(bob), [])
+        self.assertEqual(Follow.objects.followers(susan), [])
+
+    def test_counters(self):
+        bob, steve, susan, amy = (self.user_bob.profile, self.user_steve.profile, self.user_susan.profile,
+                                  self.user_amy.profile)
+        Friend.objects.add_friend(bob, steve).accept()
+        Friend.objects.add_friend(susan, bob)
+        Friend.objects.add_friend(amy, bob)
+        Friend.objects.accept_requests(bob)
+        Follow.objects.add_follower(bob, steve)
+        Follow.objects.add_followers(bob, [susan, amy])
+        Follow.objects.add_follower(steve, susan)
+        Follow.objects.remove_follower(bob, amy)
+
+        counts = lambda profile: Profile.objects.values_list(
+            'friend_count', 'follower_count', 'following_count').get(pk=profile.pk)
+        self.assertEqual(counts(bob), (3, 0, 2))
+        self.assertEqual(counts(steve), (1, 1, 1))
+        self.assertEqual(counts(susan), (1, 2, 0))
+        self.assertEqual(counts(amy), (1, 0, 0))
+
+        Friend.objects.remove_friend(bob, steve)
+        self.assertEqual(counts(bob), (2, 0, 2))
+        self.assertEqual(counts(steve), (0, 1, 1))
+
+        Profile.objects.update(friend_count=42, follower_count=42, following_count=42)
+        call_command('recount_relationships', stdout=StringIO())
+        self.assertEqual(counts(bob), (2, 0, 2))
+        self.assertEqual(counts(susan), (1, 2, 0))
+
+        # Saving a profile never writes its stale in-memory counters back
+        self.user_bob.save()
+        self.assertEqual(counts(bob), (2, 0, 2))
+
+        # The relations of a deleted profile are discounted from the others
+        self.user_susan.delete()
+        self.assertEqual(counts(bob), (1, 0, 1))
+        self.assertEqual(counts(steve), (0, 1, 0))
+
+        # Decrements stop at 0 on counters out of sync
+        Profile.objects.update(friend_count=0)
+        Friend.objects.remove_friend(bob, amy)
+        self.assertEqual(counts(amy), (0, 0, 0))
+
+
+class SuggestionModelTests(BaseTestCase):
+
+    def test_friends_of_friends(self):
+        bob, steve, susan, amy = (self.user_bob.profile, self.user_steve.profile, self.user_susan.profile,
+                                  self.user_amy.profile)
+        Friend.objects.add_friend(bob, steve).accept()
+        Friend.objects.add_friend(bob, susan).accept()
+        self.assertEqual([s.candidate for s in Suggestion.objects.suggestions(steve)], [susan])
+        self.assertEqual([s.candidate for s in Suggestion.objects.suggestions(susan)], [steve])
+        self.assertEqual(Suggestion.objects.suggestions(bob), [])
+
+        Friend.objects.add_friend(amy, steve).accept()
+        Friend.objects.add_friend(amy, susan).accept()
+        # Bob and Amy now share two friends, Steve and Susan
+        self.assertEqual([(s.candidate, s.mutual_count) for s in Suggestion.objects.suggestions(bob)], [(amy, 2)])
+        self.assertEqual([(s.candidate, s.mutual_count) for s in Suggestion.objects.suggestions(steve)],
+                         [(susan, 2)])
+
+        # Suggestions disappear once connected
+        Friend.objects.add_friend(bob, amy).accept()
+        self.assertEqual(Suggestion.objects.suggestions(bob), [])
+        self.assertEqual(Suggestion.objects.filter(user=amy, candidate=bob).count(), 0)
+
+    def test_followees_of_followees(self):
+        bob, steve, susan = self.user_bob.profile, self.user_steve.profile, self.user_susan.profile
+        Follow.objects.add_follower(steve, susan)
+        Follow.objects.add_follower(bob, steve)
+        self.assertEqual([s.candidate for s in Suggestion.objects.suggestions(bob)], [susan])
+
+        Follow.objects.add_follower(bob, susan)
+        self.assertEqual(Suggestion.objects.suggestions(bob), [])
+
+    def test_suggestions_limit(self):
+        bob, steve, susan = self.user_bob.profile, self.user_steve.profile, self.user_susan.profile
+        Follow.objects.add_follower(bob, steve)
+        # A stale suggestion of a followee ranks first but is skipped before the limit
+        Suggestion.objects.bulk_create([Suggestion(user=bob, candidate=steve, mutual_count=2),
+                                        Suggestion(user=bob, candidate=susan, mutual_count=1)])
+        self.assertEqual([s.candidate for s in Suggestion.objects.suggestions(bob, limit=1)], [susan])
+
+    def test_bulk_accept_counts_once(self):
+        bob, steve, susan = self.user_bob.profile, self.user_steve.profile, self.user_susan.profile
+        Friend.objects.add_friend(steve, bob)
+        Friend.objects.add_friend(susan, bob)
+        Friend.objects.accept_requests(bob)
+        # Each accept sees the other new friend, bob is still their only mutual friend
+        self.assertEqual([(s.candidate, s.mutual_count) for s in Suggestion.objects.suggestions(steve)],
+                         [(susan, 1)])
+        self.assertEqual([(s.candidate, s.mutual_count) for s in Suggestion.objects.suggestions(susan)],
+                         [(steve, 1)])
+
+    @override_settings(REST_FRIENDSHIP={'SUGGESTIONS_SIZE': 1})
+    def test_top_k(self):
+        bob, steve, susan, amy = (self.user_bob.profile, self.user_steve.profile, self.user_susan.profile,
+                                  self.user_amy.profile)
+        Friend.objects.add_friend(bob, steve).accept()
+        Friend.objects.add_friend(steve, amy).accept()
+        # Bob also follows steve who follows amy
+        Follow.objects.add_follower(steve, amy)
+        Follow.objects.add_follower(bob, steve)
+        self.assertEqual([(s.candidate, s.mutual_count) for s in Suggestion.objects.filter(user=bob)], [(amy, 2)])
+
+        # The newer but lower ranked susan is trimmed
+        Friend.objects.add_friend(steve, susan).accept()
+        self.assertEqual([(s.candidate, s.mutual_count) for s in Suggestion.objects.filter(user=bob)], [(amy, 2)])
+
+
+class OutboxModelTests(BaseTestCase):
+
+    def events(self):
+        return list(OutboxEvent.objects.values_list('type', 'actor', 'target'))
+
+    def test_record(self):
+        bob, steve, susan = self.user_bob.profile, self.user_steve.profile, self.user_susan.profile
+        Friend.objects.add_friend(bob, steve).accept()
+        Friend.objects.add_friend(bob, susan).reject()
+        Friend.objects.add_friend(steve, susan).cancel()
+        Friend.objects.remove_friend(bob, steve)
+        Friend.objects.add_friend(susan, steve).mark_viewed()
+        Follow.objects.add_follower(bob, steve)
+        Follow.objects.remove_follower(bob, steve)
+        self.assertEqual(self.events(), [
+            (OutboxEvent.REQUEST_CREATED, bob.pk, steve.pk),
+            (OutboxEvent.REQUEST_ACCEPTED, steve.pk, bob.pk),
+            (OutboxEvent.REQUEST_CREATED, bob.pk, susan.pk),
+            (OutboxEvent.REQUEST_REJECTED, susan.pk, bob.pk),
+            (OutboxEvent.REQUEST_CREATED, steve.pk, susan.pk),
+            (OutboxEvent.REQUEST_CANCELED, steve.pk, susan.pk),
+            (OutboxEvent.FRIENDSHIP_REMOVED, bob.pk, steve.pk),
+            (OutboxEvent.REQUEST_CREATED, susan.pk, steve.pk),
+            (OutboxEvent.REQUEST_VIEWED, steve.pk, susan.pk),
+            (OutboxEvent.FOLLOW_CREATED, bob.pk, steve.pk),
+            (OutboxEvent.FOLLOW_REMOVED, bob.pk, steve.pk),
+        ])
+
+        # Failed writes record nothing
+        OutboxEvent.objects.all().delete()
+        amy = self.user_amy.profile
+        request = Friend.objects.add_friend(bob, amy)
+        with self.assertRaises(AlreadyExistsError):
+            Friend.objects.add_friend(bob, amy)
+        self.assertEqual(list(OutboxEvent.objects.values_list('type', 'actor', 'target', 'subject')),
+                         [(OutboxEvent.REQUEST_CREATED, bob.pk, amy.pk, request.pk)])
+
+    def test_drain(self):
+        bob, steve, susan = self.user_bob.profile, self.user_steve.profile, self.user_susan.profile
+        Follow.objects.add_followers(bob, [steve, susan])
+        Friend.objects.add_friends(bob, [steve, susan])
+        self.assertEqual(OutboxEvent.objects.count(), 4)
+
+        batches = []
+
+        def receive(sender, events, **kwargs):
+            batches.append([(event.type, event.target) for event in events])
+        outbox_events.connect(receive)
+        self.addCleanup(outbox_events.disconnect, receive)
+
+        out = StringIO()
+        call_command('drain_outbox', batch_size=3, stdout=out)
+        self.assertEqual([len(batch) for batch in batches], [3, 1])
+        self.assertEqual(batches[0][:2], [(OutboxEvent.FOLLOW_CREATED, steve.pk),
+                                          (OutboxEvent.FOLLOW_CREATED, susan.pk)])
+        self.assertIn('Drained 4 events', out.getvalue())
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_drain_sets_failures_aside(self):
+        bob, steve, susan = self.user_bob.profile, self.user_steve.profile, self.user_susan.profile
+        Follow.objects.add_followers(bob, [steve, susan])
+        calls = []
+
+        def fail(sender, events, **kwargs):
+            calls.append(len(events))
+            if any(event.target == steve.pk for event in events):
+                raise RuntimeError
+        outbox_events.connect(fail)
+        self.addCleanup(outbox_events.disconnect, fail)
+
+        # The failing event doesn't hold back the others
+        with self.assertLogs('rest_friendship.models', 'ERROR'):
+            self.assertEqual(OutboxEvent.objects.drain(), 1)
+        self.assertEqual(calls, [2, 1, 1])
+        self.assertEqual(list(OutboxEvent.objects.values_list('target', 'attempts', 'failed')), [(steve.pk, 1, None)])
+
+        with override_settings(REST_FRIENDSHIP={'OUTBOX_MAX_ATTEMPTS': 2}):
+            with self.assertLogs('rest_friendship.models', 'ERROR'):
+                self.assertEqual(OutboxEvent.objects.drain(), 0)
+            event = OutboxEvent.objects.get()
+            self.assertEqual(event.attempts, 2)
+            self.assertIsNotNone(event.failed)
+
+            # Set aside until retried
+            del calls[:]
+            self.assertEqual(OutboxEvent.objects.drain(), 0)
+            self.assertEqual(calls, [])
+
+        outbox_events.disconnect(fail)
+        out = StringIO()
+        call_command('drain_outbox', retry_failed=True, stdout=out)
+        self.assertIn('Retrying 1 failed events', out.getvalue())
+        self.assertIn('Drained 1 events', out.getvalue())
+        self.assertFalse(OutboxEvent.objects.exists())
@@ -1,11 +1,10 @@
 from django.contrib.auth.models import User
-from django.core.cache import cache
-from django.test import RequestFactory
+from django.test import RequestFactory, override_settings
 from django.utils.http import urlencode
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient, APITestCase
 
-from rest_friendship.models import Friend, Follow
+from rest_friendship.models import Friend, Follow, FriendshipRequest, cache
 from rest_friendship.serializers import FriendshipSerializer, FriendshipRequestSerializer, FollowSerializer
 
 
@@ -87,7 +86,7 @@ class FriendshipViewTests(BaseTestCase):
         response = self.client.get(url)
         friends = Friend.objects.friends(self.user_bob.profile)
         serializer = FriendshipSerializer(friends, many=True)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
         self.assertResponse200(response)
         self.client.force_authenticate()
 
@@ -117,7 +116,7 @@ class FriendshipViewTests(BaseTestCase):
         requests = Friend.objects.unrejected_requests(self.user_amy.profile)
         serializer = FriendshipRequestSerializer(requests, many=True, context={'request': req})
         self.assertResponse200(response)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
         self.client.force_authenticate()
 
         # test if username doesn't exist
@@ -129,6 +128,155 @@ class FriendshipViewTests(BaseTestCase):
         self.assertResponse404(response)
         self.client.force_authenticate()
 
+    def test_friendship_add_friends(self):
+        url = reverse('friend-add-friends')
+        data = {'usernames': [self.user_amy.username, self.user_steve.username, 'tartanpion']}
+
+        # test that the view requires authentication to access it
+        response = self.client.post(url, data, format='json')
+        self.assertResponse401(response)
+
+        self.client.force_authenticate(self.user_bob)
+        response = self.client.post(url, data, format='json')
+        self.assertResponse202(response)
+        self.assertEqual(response.data, {'results': [
+            {'username': self.user_amy.username, 'status': 'created'},
+            {'username': self.user_steve.username, 'status': 'created'},
+            {'username': 'tartanpion', 'status': 'not_found'},
+        ]})
+        self.assertEqual(len(Friend.objects.sent_requests(self.user_bob.profile)), 2)
+
+        url = reverse_querystring('friend-add-friends', query_kwargs={'usernames': self.user_amy.username})
+        response = self.client.post(url)
+        self.assertResponse202(response)
+        self.assertEqual(response.data, {'results': [{'username': self.user_amy.username, 'status': 'already_exists'}]})
+
+        # repeated form fields are all kept
+        response = self.client.post(reverse('friend-add-friends'),
+                                    {'usernames': [self.user_amy.username, self.user_susan.username]})
+        self.assertResponse202(response)
+        self.assertEqual(response.data, {'results': [
+            {'username': self.user_amy.username, 'status': 'already_exists'},
+            {'username': self.user_susan.username, 'status': 'created'},
+        ]})
+
+        response = self.client.post(reverse('friend-add-friends'))
+        self.assertResponse400(response)
+        response = self.client.post(reverse('friend-add-friends'), [self.user_amy.username], format='json')
+        self.assertResponse400(response)
+        response = self.client.post(reverse('friend-add-friends'), {'usernames': {'a': 1}}, format='json')
+        self.assertResponse400(response)
+        response = self.client.post(reverse('friend-add-friends'), {'usernames': [1]}, format='json')
+        self.assertResponse400(response)
+        self.client.force_authenticate()
+
+    def test_friendship_mutual_friends(self):
+        self.friendship_request.accept()
+        Friend.objects.add_friend(self.user_amy.profile, self.user_bob.profile).accept()
+        Friend.objects.add_friend(self.user_amy.profile, self.user_susan.profile).accept()
+        Friend.objects.add_friend(self.user_steve.profile, self.user_susan.profile).accept()
+        # Dave is only friends with bob
+        user_dave = self.create_user('dave', 'dave@dave.com', self.user_pw)
+        Friend.objects.add_friend(user_dave.profile, self.user_bob.profile).accept()
+        url = reverse_querystring('friend-mutual-friends', query_kwargs={'username': self.user_susan.username})
+
+        # test that the view requires authentication to access it
+        response = self.client.get(url)
+        self.assertResponse401(response)
+
+        self.client.force_authenticate(self.user_bob)
+        response = self.client.get(url)
+        self.assertResponse200(response)
+        self.assertEqual(response.data['count'], 2)
+        req = self.factory.get(url)
+        friends = Friend.objects.filter(to_user=self.user_bob.profile).exclude(
+            from_user=user_dave.profile).order_by('-created', '-id')
+        serializer = FriendshipSerializer(friends, many=True, context={'request': req})
+        self.assertEqual(response.data['results'], serializer.data)
+
+        url = reverse_querystring('friend-mutual-friends', query_kwargs={'username': 'tartanpion'})
+        response = self.client.get(url)
+        self.assertResponse404(response)
+        self.client.force_authenticate()
+
+    def test_friendship_events(self):
+        url = reverse_querystring('friend-events', query_kwargs={'timeout': 0})
+
+        # test that the view requires authentication to access it
+        response = self.client.get(url)
+        self.assertResponse401(response)
+
+        self.client.force_authenticate(self.user_bob)
+        response = self.client.get(url)
+        self.assertResponse200(response)
+        self.assertEqual(response.data['events'], [])
+        last_id = response.data['last_id']
+
+        Friend.objects.add_friend(self.user_amy.profile, self.user_bob.profile)
+        response = self.client.get(reverse_querystring('friend-events', query_kwargs={'timeout': 0,
+                                                                                     'since': last_id}))
+        self.assertResponse200(response)
+        self.assertEqual([event['type'] for event in response.data['events']], ['friendship_request_created'])
+        self.assertEqual(response.data['last_id'], last_id + 1)
+
+        response = self.client.get(reverse_querystring('friend-events', query_kwargs={'since': 'foo'}))
+        self.assertResponse400(response)
+        self.client.force_authenticate()
+
+    def test_friendship_events_max_waiters(self):
+        self.client.force_authenticate(self.user_bob)
+        with override_settings(FRIENDSHIP_EVENTS_MAX_WAITERS=0):
+            response = self.client.get(reverse_querystring('friend-events', query_kwargs={'timeout': 5}))
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '5')
+            # Polls that do not wait never need a slot
+            response = self.client.get(reverse_querystring('friend-events', query_kwargs={'timeout': 0}))
+            self.assertResponse200(response)
+        self.client.force_authenticate()
+
+    def test_friendship_suggestions(self):
+        self.friendship_request.accept()
+        Friend.objects.add_friend(self.user_steve.profile, self.user_susan.profile).accept()
+        url = reverse('friend-suggestions')
+
+        # test that the view requires authentication to access it
+        response = self.client.get(url)
+        self.assertResponse401(response)
+
+        self.client.force_authenticate(self.user_bob)
+        response = self.client.get(url)
+        self.assertResponse200(response)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['username'], self.user_susan.username)
+        self.assertEqual(response.data[0]['mutual_count'], 1)
+
+        for limit in ('foo', 0, -1):
+            response = self.client.get(reverse_querystring('friend-suggestions', query_kwargs={'limit': limit}))
+            self.assertResponse400(response)
+        self.client.force_authenticate()
+
+    def test_friendship_relationships(self):
+        self.friendship_request.accept()
+        url = reverse_querystring('friend-relationships', query_kwargs={
+            'profile_ids': '%s,%s' % (self.user_steve.profile.pk, self.user_amy.profile.pk)})
+
+        # test that the view requires authentication to access it
+        response = self.client.get(url)
+        self.assertResponse401(response)
+
+        self.client.force_authenticate(self.user_bob)
+        response = self.client.get(url)
+        self.assertResponse200(response)
+        results = {result['profile']: result for result in response.data['results']}
+        self.assertTrue(results[self.user_steve.profile.pk]['friends'])
+        self.assertFalse(results[self.user_steve.profile.pk]['following'])
+        self.assertFalse(results[self.user_amy.profile.pk]['friends'])
+        self.assertTrue(results[self.user_amy.profile.pk]['following'])
+
+        response = self.client.get(reverse_querystring('friend-relationships', query_kwargs={'profile_ids': 'foo'}))
+        self.assertResponse400(response)
+        self.client.force_authenticate()
+
     def test_friendship_add_friend_dupe(self):
         url = reverse_querystring('friend-add-friend', query_kwargs={'username': self.user_amy.username})
 
@@ -151,6 +299,15 @@ class FriendshipViewTests(BaseTestCase):
         self.assertEqual(response.data, {'code': 5001, 'message': 'Friendship request already exist'})
         self.client.force_authenticate()
 
+        # already friends
+        self.friendship_request.accept()
+        self.client.force_authenticate(self.user_bob)
+        url = reverse_querystring('friend-add-friend', query_kwargs={'username': self.user_steve.username})
+        response = self.client.post(url)
+        self.assertResponse400(response)
+        self.assertEqual(response.data, {'code': 5002, 'message': 'Users are already friends'})
+        self.client.force_authenticate()
+
         url = reverse('friendshiprequest-list')
         self.client.force_authenticate(self.user_amy)
         # the `username` receive a friend request
@@ -158,7 +315,7 @@ class FriendshipViewTests(BaseTestCase):
         req = self.factory.post(url)
         requests = Friend.objects.unrejected_requests(self.user_amy.profile)
         serializer = FriendshipRequestSerializer(requests, many=True, context={'request': req})
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
         self.client.force_authenticate()
 
     def test_friendship_requests(self):
@@ -174,7 +331,7 @@ class FriendshipViewTests(BaseTestCase):
         req = self.factory.get(url)
         requests = Friend.objects.unrejected_requests(self.user_bob.profile)
         serializer = FriendshipRequestSerializer(requests, many=True, context={'request': req})
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
         self.client.force_authenticate()
 
     def test_friendship_requests_sent(self):
@@ -190,7 +347,7 @@ class FriendshipViewTests(BaseTestCase):
         req = self.factory.get(url)
         requests = Friend.objects.sent_requests(self.user_bob.profile)
         serializer = FriendshipRequestSerializer(requests, many=True, context={'request': req})
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
         self.client.force_authenticate()
 
     def test_friendship_requests_rejected(self):
@@ -206,7 +363,7 @@ class FriendshipViewTests(BaseTestCase):
         req = self.factory.get(url)
         requests = Friend.objects.rejected_requests(self.user_bob.profile)
         serializer = FriendshipRequestSerializer(requests, many=True, context={'request': req})
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
         self.client.force_authenticate()
 
     def test_friendship_accept(self):
@@ -240,7 +397,7 @@ class FriendshipViewTests(BaseTestCase):
         req = self.factory.get(url)
         requests = Friend.objects.unrejected_requests(self.user_bob.profile)
         serializer = FriendshipRequestSerializer(requests, many=True, context={'request': req})
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
         self.client.force_authenticate()
 
     def test_friendship_reject(self):
@@ -273,7 +430,56 @@ class FriendshipViewTests(BaseTestCase):
         req = self.factory.get(url)
         requests = Friend.objects.rejected_requests(self.user_bob.profile)
         serializer = FriendshipRequestSerializer(requests, many=True, context={'request': req})
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
+        self.client.force_authenticate()
+
+    def test_friendship_accept_reject_many(self):
+        susan_request = Friend.objects.add_friend(self.user_susan.profile, self.user_bob.profile)
+        amy_request = Friend.objects.add_friend(self.user_amy.profile, self.user_bob.profile)
+        url = reverse_querystring('friendshiprequest-accept-requests')
+
+        # test that the view requires authentication to access it
+        response = self.client.post(url)
+        self.assertResponse401(response)
+
+        self.client.force_authenticate(self.user_bob)
+        response = self.client.post(url, {'request_ids': 'foo'})
+        self.assertResponse400(response)
+
+        response = self.client.post(url, {'request_ids': [self.friendship_request.pk, susan_request.pk]},
+                                    format='json')
+        self.assertResponse202(response)
+        self.assertEqual(sorted(response.data['accepted']), sorted([self.friendship_request.pk, susan_request.pk]))
+        self.assertTrue(Friend.objects.are_friends(self.user_bob.profile, self.user_steve.profile))
+        self.assertTrue(Friend.objects.are_friends(self.user_bob.profile, self.user_susan.profile))
+
+        # only a true `all` targets every request
+        url = reverse_querystring('friendshiprequest-reject-requests', query_kwargs={'all': 'false'})
+        response = self.client.post(url)
+        self.assertResponse400(response)
+        response = self.client.post(reverse('friendshiprequest-reject-requests'), {'all': 0}, format='json')
+        self.assertResponse400(response)
+        self.assertEqual(len(Friend.objects.unrejected_requests(self.user_bob.profile)), 1)
+
+        url = reverse_querystring('friendshiprequest-reject-requests', query_kwargs={'all': 'true'})
+        response = self.client.post(url)
+        self.assertResponse202(response)
+        self.assertEqual(response.data, {'rejected': [amy_request.pk]})
+        self.assertEqual(len(Friend.objects.unrejected_requests(self.user_bob.profile)), 0)
+        self.client.force_authenticate()
+
+    def test_friendship_counts(self):
+        url = reverse('friendshiprequest-counts')
+
+        # test that the view requires authentication to access it
+        response = self.client.get(url)
+        self.assertResponse401(response)
+
+        self.client.force_authenticate(self.user_bob)
+        response = self.client.get(url)
+        self.assertResponse200(response)
+        self.assertEqual(response.data, {'unread_request_count': 1, 'sent_request_count': 0,
+                                         'follower_count': 0, 'following_count': 1})
         self.client.force_authenticate()
 
     def test_friendship_cancel(self):
@@ -307,7 +513,20 @@ class FriendshipViewTests(BaseTestCase):
         req = self.factory.get(url)
         requests = Friend.objects.unrejected_requests(self.user_bob.profile)
         serializer = FriendshipRequestSerializer(requests, many=True, context={'request': req})
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
+        self.client.force_authenticate()
+
+    def test_generic_writes_not_allowed(self):
+        # Writes must go through the actions, which bust the caches, keep the counters and record the outbox
+        self.client.force_authenticate(self.user_bob)
+        for name, obj in (('friendshiprequest', self.friendship_request), ('follow', self.follow_request)):
+            self.assertResponse405(self.client.post(reverse('%s-list' % name), {}))
+            detail = reverse('%s-detail' % name, kwargs={'pk': obj.pk})
+            self.assertResponse405(self.client.put(detail, {}))
+            self.assertResponse405(self.client.patch(detail, {}))
+            self.assertResponse405(self.client.delete(detail))
+        self.assertTrue(Follow.objects.filter(pk=self.follow_request.pk).exists())
+        self.assertTrue(FriendshipRequest.objects.filter(pk=self.friendship_request.pk).exists())
         self.client.force_authenticate()
 
     def test_followers_list(self):
@@ -321,8 +540,73 @@ class FriendshipViewTests(BaseTestCase):
         response = self.client.get(url)
         followers = Follow.objects.followers(self.user_bob.profile)
         serializer = FollowSerializer(followers, many=True)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
+        self.assertResponse200(response)
+        self.client.force_authenticate()
+
+    def test_followers_list_pagination(self):
+        Follow.objects.add_follower(self.user_steve.profile, self.user_amy.profile)
+        Follow.objects.add_follower(self.user_susan.profile, self.user_amy.profile)
+        url = reverse_querystring('follow-list', query_kwargs={'page_size': 2})
+
+        self.client.force_authenticate(self.user_amy)
+        response = self.client.get(url)
+        self.assertResponse200(response)
+        self.assertEqual([follow['id'] for follow in response.data['results']],
+                         list(Follow.objects.filter(followee=self.user_amy.profile).order_by('-created', '-id')
+                              .values_list('id', flat=True)[:2]))
+        self.assertIsNone(response.data['previous'])
+
+        response = self.client.get(response.data['next'])
+        self.assertResponse200(response)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+        self.client.force_authenticate()
+
+    def test_followers_list_conditional(self):
+        url = reverse_querystring('follow-list')
+
+        self.client.force_authenticate(self.user_amy)
+        response = self.client.get(url)
+        self.assertResponse200(response)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        # Another list of the same user has its own ETag
+        response = self.client.get(reverse_querystring('follow-list', query_kwargs={'following': 'true'}),
+                                   HTTP_IF_NONE_MATCH=etag)
         self.assertResponse200(response)
+
+        Follow.objects.add_follower(self.user_steve.profile, self.user_amy.profile)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertResponse200(response)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertNotEqual(response['ETag'], etag)
+        self.client.force_authenticate()
+
+    def test_followers_list_compact(self):
+        Follow.objects.add_follower(self.user_steve.profile, self.user_amy.profile)
+        url = reverse_querystring('follow-list', query_kwargs={'compact': 'true', 'page_size': 1})
+
+        self.client.force_authenticate(self.user_amy)
+        response = self.client.get(url)
+        self.assertResponse200(response)
+        follow = Follow.objects.get(follower=self.user_steve.profile, followee=self.user_amy.profile)
+        self.assertEqual(len(response.data['results']), 1)
+        result = response.data['results'][0]
+        self.assertEqual(result['id'], follow.pk)
+        self.assertEqual(result['follower'], {'id': self.user_steve.profile.pk,
+                                              'pseudo': self.user_steve.profile.pseudo, 'img': None})
+        self.assertEqual(result['followee']['id'], self.user_amy.profile.pk)
+
+        response = self.client.get(response.data['next'])
+        self.assertResponse200(response)
+        self.assertEqual(response.data['results'][0]['follower']['id'], self.user_bob.profile.pk)
         self.client.force_authenticate()
 
     def test_following_list(self):
@@ -338,7 +622,7 @@ class FriendshipViewTests(BaseTestCase):
         req = self.factory.get(url)
         follows = Follow.objects.filter(follower=self.user_bob.profile).all()
         serializer = FollowSerializer(follows, many=True, context={'request': req})
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
         self.assertResponse200(response)
         self.client.force_authenticate()
 
@@ -361,7 +645,7 @@ class FriendshipViewTests(BaseTestCase):
         req = self.factory.get(url)
         follows = Follow.objects.filter(follower=self.user_bob.profile).all()
         serializer = FollowSerializer(follows, many=True, context={'request': req})
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
 
         url = reverse_querystring('follow-add-follow', query_kwargs={'username': self.user_susan.username})
         response = self.client.post(url)
@@ -373,6 +657,31 @@ class FriendshipViewTests(BaseTestCase):
         self.assertResponse404(response)
         self.client.force_authenticate()
 
+    def test_follower_add_remove_many(self):
+        data = {'usernames': [self.user_amy.username, self.user_susan.username]}
+
+        # test that the view requires authentication to access it
+        response = self.client.post(reverse('follow-add-follows'), data, format='json')
+        self.assertResponse401(response)
+
+        self.client.force_authenticate(self.user_bob)
+        response = self.client.post(reverse('follow-add-follows'), data, format='json')
+        self.assertResponse202(response)
+        self.assertEqual(response.data, {'results': [
+            {'username': self.user_amy.username, 'status': 'already_exists'},
+            {'username': self.user_susan.username, 'status': 'created'},
+        ]})
+        self.assertTrue(Follow.objects.follows(self.user_bob.profile, self.user_susan.profile))
+
+        response = self.client.post(reverse('follow-remove-follows'), data, format='json')
+        self.assertResponse202(response)
+        self.assertEqual(response.data, {'results': [
+            {'username': self.user_amy.username, 'status': 'removed'},
+            {'username': self.user_susan.username, 'status': 'removed'},
+        ]})
+        self.assertEqual(Follow.objects.following(self.user_bob.profile), [])
+        self.client.force_authenticate()
+
     def test_follower_remove(self):
         url = reverse_querystring('follow-remove-follow', query_kwargs={'username': self.user_amy.username})
 
@@ -392,7 +701,7 @@ class FriendshipViewTests(BaseTestCase):
         req = self.factory.get(url)
         follows = Follow.objects.filter(follower=self.user_bob.profile).all()
         serializer = FollowSerializer(follows, many=True, context={'request': req})
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
 
         url = reverse_querystring('follow-remove-follow', query_kwargs={'username': self.user_amy.username})
         response = self.client.post(url)
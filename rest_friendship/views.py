@@ -1,24 +1,156 @@
+import hashlib
+
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.http import QueryDict
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 
-from rest_friendship.exceptions import AlreadyExistsError
-from rest_friendship.models import Friend, Follow
-from rest_friendship.serializers import FriendshipSerializer, FriendshipRequestSerializer, FollowSerializer
+from rest_friendship.events import get_broker, waiter_slot
+from rest_friendship.exceptions import AlreadyExistsError, AlreadyFriendsError
+from rest_friendship.models import Friend, Follow, FriendshipRequest, Suggestion, cache_generations, \
+    generation_time, profile_pk, relationships
+from rest_friendship.serializers import FriendshipSerializer, FriendshipRequestSerializer, FollowSerializer, \
+    SuggestionSerializer, CompactFriendshipSerializer, CompactFriendshipRequestSerializer, CompactFollowSerializer
 from rest_profile.models import Profile
 
 get_friendship_context_object_name = lambda: getattr(settings, 'FRIENDSHIP_CONTEXT_OBJECT_NAME', 'user')
 get_friendship_context_object_list_name = lambda: getattr(settings, 'FRIENDSHIP_CONTEXT_OBJECT_LIST_NAME', 'users')
+get_friendship_bulk_max_size = lambda: getattr(settings, 'FRIENDSHIP_BULK_MAX_SIZE', 100)
+get_friendship_events_timeout = lambda: getattr(settings, 'FRIENDSHIP_EVENTS_TIMEOUT', 25)
+get_friendship_events_max_waiters = lambda: getattr(settings, 'FRIENDSHIP_EVENTS_MAX_WAITERS', 4)
+
+
+def get_bulk_values(request, name):
+    """
+    Values of a bulk action, sent as a JSON list, repeated form fields or a
+    comma separated string, in the body or the query params
+    """
+    data = request.data
+    if isinstance(data, QueryDict):
+        values = data.getlist(name)
+    elif isinstance(data, dict):
+        values = data.get(name, None)
+    else:
+        raise ValidationError({name: 'The body must be an object'})
+    if not values:
+        values = request.query_params.getlist(name)
+    if isinstance(values, str):
+        values = [values]
+    if not isinstance(values, list):
+        raise ValidationError({name: 'Expected a list or a comma separated string'})
+    return [item for value in values for item in (value.split(',') if isinstance(value, str) else [value])]
+
+
+def get_bulk_profiles(request):
+    """
+    Resolve the `usernames` of a bulk action in a single query. Return the
+    usernames and a dict of profiles by username.
+    """
+    usernames = get_bulk_values(request, 'usernames')
+    if not all(isinstance(username, str) for username in usernames):
+        raise ValidationError({'usernames': 'Usernames must be strings'})
+    usernames = [username for username in usernames if username]
+    if not usernames or len(usernames) > get_friendship_bulk_max_size():
+        raise ValidationError({'usernames': 'Between 1 and %s usernames are required' % get_friendship_bulk_max_size()})
+    profiles = Profile.objects.select_related('owner').filter(owner__username__in=usernames)
+    return usernames, {profile.owner.username: profile for profile in profiles}
+
+
+def get_bulk_ids(request, name):
+    """
+    Integer ids of a bulk action, sent like `get_bulk_values`
+    """
+    try:
+        ids = [int(pk) for pk in get_bulk_values(request, name) if pk != '']
+    except (TypeError, ValueError):
+        raise ValidationError({name: 'Ids must be integers'})
+    if not ids or len(ids) > get_friendship_bulk_max_size():
+        raise ValidationError({name: 'Between 1 and %s ids are required' % get_friendship_bulk_max_size()})
+    return ids
+
+
+def get_bulk_request_ids(request):
+    """
+    Ids of a bulk action on friendship requests, sent as `request_ids`.
+    None when `all` unread requests are targeted, only a true `all` counts.
+    """
+    value = request.data.get('all', None) if isinstance(request.data, dict) else None
+    if value is None:
+        value = request.query_params.get('all', None)
+    if value in ('1', 'true', 'True', True, 1):
+        return None
+    return get_bulk_ids(request, 'request_ids')
+
+
+class CompactListMixin(object):
+    """
+    Lists `values()` rows through `compact_serializer_class` when the
+    `compact` query parameter is set, skipping model instances and
+    hyperlinks
+    """
+    compact_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('compact', None) is None:
+            return super(CompactListMixin, self).list(request, *args, **kwargs)
+
+        serializer_class = self.compact_serializer_class
+        queryset = self.filter_queryset(self.get_queryset()).values(*serializer_class.value_names())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer_class(page, many=True).data)
+        return Response(serializer_class(queryset, many=True).data)
+
+
+class ConditionalListMixin(object):
+    """
+    Answers list requests with a 304 Not Modified, before any query or
+    serialization, while the cache generations of `version_groups` are
+    the ones the client's ETag or Last-Modified were built from
+    """
+
+    def version_groups(self):
+        """ Bust groups of the user the list depends on """
+        return []
+
+    def list(self, request, *args, **kwargs):
+        # Compact lists embed profile fields which are not versioned
+        if request.query_params.get('compact', None) is not None:
+            return super(ConditionalListMixin, self).list(request, *args, **kwargs)
+
+        pk = profile_pk(request.user)
+        generations = cache_generations([(group, pk) for group in self.version_groups()])
+        etag = '"%s"' % hashlib.md5('|'.join(generations + [request.get_full_path()]).encode()).hexdigest()
+        last_modified = max(generation_time(generation) for generation in generations)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super(ConditionalListMixin, self).list(request, *args, **kwargs)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+        return response
 
 
-class FriendshipRequestViewSet(viewsets.ModelViewSet):
+def bulk_response(usernames, profiles, outcomes):
+    """ Per username outcomes of a bulk action """
+    results = [{'username': username,
+                'status': outcomes[profiles[username].pk] if username in profiles else 'not_found'}
+               for username in usernames]
+    return Response({'results': results}, status=status.HTTP_202_ACCEPTED)
+
+
+class FriendshipRequestViewSet(ConditionalListMixin, CompactListMixin, viewsets.ReadOnlyModelViewSet):
     """
-        This viewset automatically provides `list`, `create`, `retrieve`,
-        `update` and `destroy` actions.
+        This viewset automatically provides `list` and `retrieve` actions.
+        Writes go through the actions below so they keep the caches, counters
+        and outbox in step.
 
           parameters:
             - name: rejected
@@ -31,9 +163,16 @@ class FriendshipRequestViewSet(viewsets.ModelViewSet):
             type: string
             required: true
             description: FriendshipRequests send
+
+            - name: compact
+            in: query
+            type: bool
+            description: Embed a profile summary instead of hyperlinks
     """
 
     serializer_class = FriendshipRequestSerializer
+    compact_serializer_class = CompactFriendshipRequestSerializer
+    cursor_ordering = ('-created', '-id')
 
     def get_queryset(self):
         """
@@ -43,11 +182,25 @@ class FriendshipRequestViewSet(viewsets.ModelViewSet):
         rejected = self.request.query_params.get('rejected', None)
         sent = self.request.query_params.get('sent', None)
         owner = Profile.objects.get(owner=self.request.user)
+        qs = FriendshipRequest.objects.select_related('from_user', 'to_user')
         if rejected is not None:
-            return Friend.objects.rejected_requests(owner)
+            return qs.filter(to_user=owner, rejected__isnull=False)
         if sent is not None:
-            return Friend.objects.sent_requests(owner)
-        return Friend.objects.unread_requests(owner)
+            return qs.filter(from_user=owner)
+        return qs.filter(to_user=owner, viewed__isnull=True)
+
+    def version_groups(self):
+        if self.request.query_params.get('sent', None) is not None:
+            return ['sent_requests']
+        return ['requests']
+
+    @action(methods=['get'], detail=False, url_name='counts', url_path='counts')
+    def friendship_counts(self, arg):
+        """
+            Unread requests, pending sent requests, followers and following counts
+        """
+        # Only the pk is needed, spare the profile query
+        return Response(Friend.objects.counts(Profile(pk=profile_pk(self.request.user))))
 
     @action(methods=['post'], detail=False, url_name='accept-request', url_path='accept_request')
     def friendship_accept(self, arg):
@@ -64,7 +217,8 @@ class FriendshipRequestViewSet(viewsets.ModelViewSet):
         if friendship_request_id is not None:
             request = get_object_or_404(Profile, owner=self.request.user)
             try:
-                request = request.friendship_requests_received.get(id=friendship_request_id)
+                request = request.friendship_requests_received.select_related('from_user', 'to_user').get(
+                    id=friendship_request_id)
             except ObjectDoesNotExist as e:
                 raise NotFound('request id : ' + str(friendship_request_id) + ' does not exist !')
             else:
@@ -101,6 +255,48 @@ class FriendshipRequestViewSet(viewsets.ModelViewSet):
                                                  many=True, context={'request': self.request})
         return Response(serializer.data)
 
+    @action(methods=['post'], detail=False, url_name='accept-requests', url_path='accept_requests')
+    def friendship_accept_many(self, arg):
+        """
+            Accept several friendship requests
+
+              parameters:
+                - name: request_ids
+                in: query
+                type: string
+                description: comma separated FriendshipRequests ids, or a JSON list in the body
+
+                - name: all
+                in: query
+                type: bool
+                description: accept all unread FriendshipRequests
+        """
+        to_user = get_object_or_404(Profile, owner=self.request.user)
+        requests = Friend.objects.accept_requests(to_user, get_bulk_request_ids(self.request))
+        content = {'accepted': [request.pk for request in requests]}
+        return Response(content, status=status.HTTP_202_ACCEPTED)
+
+    @action(methods=['post'], detail=False, url_name='reject-requests', url_path='reject_requests')
+    def friendship_reject_many(self, arg):
+        """
+            Reject several friendship requests
+
+              parameters:
+                - name: request_ids
+                in: query
+                type: string
+                description: comma separated FriendshipRequests ids, or a JSON list in the body
+
+                - name: all
+                in: query
+                type: bool
+                description: reject all unread FriendshipRequests
+        """
+        to_user = get_object_or_404(Profile, owner=self.request.user)
+        requests = Friend.objects.reject_requests(to_user, get_bulk_request_ids(self.request))
+        content = {'rejected': [request.pk for request in requests]}
+        return Response(content, status=status.HTTP_202_ACCEPTED)
+
     @action(methods=['post'], detail=False, url_name='cancel-request', url_path='cancel_request')
     def friendship_cancel(self, arg):
         """
@@ -126,12 +322,15 @@ class FriendshipRequestViewSet(viewsets.ModelViewSet):
         return Response(None, status=status.HTTP_400_BAD_REQUEST)
 
 
-class FriendshipViewSet(viewsets.ModelViewSet):
+class FriendshipViewSet(ConditionalListMixin, CompactListMixin, viewsets.ReadOnlyModelViewSet):
     """
-    This viewset automatically provides `list`, `create`, `retrieve`,
-    `update` and `destroy` actions.
+    This viewset automatically provides `list` and `retrieve` actions.
+    Writes go through the actions below so they keep the caches, counters
+    and outbox in step.
     """
     serializer_class = FriendshipSerializer
+    compact_serializer_class = CompactFriendshipSerializer
+    cursor_ordering = ('-created', '-id')
 
     def get_queryset(self):
         """
@@ -140,6 +339,9 @@ class FriendshipViewSet(viewsets.ModelViewSet):
         """
         return Friend.objects.select_related('from_user', 'to_user').filter(to_user=self.request.user.profile).all()
 
+    def version_groups(self):
+        return ['friends']
+
     @action(methods=['post'], detail=False, url_name='add-friend', url_path='add_friend')
     def friendship_add_friend(self, arg):
         """
@@ -164,25 +366,155 @@ class FriendshipViewSet(viewsets.ModelViewSet):
                 except AlreadyExistsError as e:
                     content = {'code': 5001, 'message': 'Friendship request already exist'}
                     return Response(content, status=status.HTTP_400_BAD_REQUEST)
+                except AlreadyFriendsError as e:
+                    content = {'code': 5002, 'message': 'Users are already friends'}
+                    return Response(content, status=status.HTTP_400_BAD_REQUEST)
                 else:
                     serializer = FriendshipRequestSerializer(Friend.objects.sent_requests(from_user),
                                                              many=True, context={'request': self.request})
                     return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
         return Response(None, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['get'], detail=False, url_name='mutual-friends', url_path='mutual_friends')
+    def friendship_mutual_friends(self, arg):
+        """
+            List the friends shared with another user
 
-class FollowViewSet(viewsets.ModelViewSet):
+              parameters:
+                - name: username
+                in: query
+                type: string
+                description: other user username
+        """
+        username = self.request.query_params.get('username', None)
+        if username is None:
+            return Response(None, status=status.HTTP_400_BAD_REQUEST)
+        user = get_object_or_404(Profile, owner=self.request.user)
+        try:
+            other = Profile.objects.get(owner__username=username)
+        except ObjectDoesNotExist as e:
+            raise NotFound(username + ' does not exist !')
+        mutual_friend_ids = Friend.objects.mutual_friend_ids(user, other)
+        qs = self.get_queryset().filter(from_user_id__in=list(mutual_friend_ids))
+        page = self.paginate_queryset(qs)
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        response.data['count'] = len(mutual_friend_ids)
+        return response
+
+    @action(methods=['get'], detail=False, url_name='events', url_path='events')
+    def friendship_events(self, arg):
+        """
+            Long poll the friendship events of the user
+
+              parameters:
+                - name: since
+                in: query
+                type: int
+                description: id of the last event received, only wait for new events by default
+
+                - name: timeout
+                in: query
+                type: float
+                description: seconds to wait for an event, capped by FRIENDSHIP_EVENTS_TIMEOUT, 503 when the
+                  FRIENDSHIP_EVENTS_MAX_WAITERS long polls of the worker are all waiting
+        """
+        pk = profile_pk(self.request.user)
+        broker = get_broker()
+        last_id = broker.last_id(pk)
+        try:
+            since = min(int(self.request.query_params.get('since', last_id)), last_id)
+            timeout = min(float(self.request.query_params.get('timeout', get_friendship_events_timeout())),
+                          get_friendship_events_timeout())
+        except ValueError:
+            return Response(None, status=status.HTTP_400_BAD_REQUEST)
+        if timeout <= 0:
+            events = broker.poll(pk, since, 0)
+        else:
+            with waiter_slot(get_friendship_events_max_waiters()) as acquired:
+                if not acquired:
+                    # Every long poll slot of this worker is taken, leave the threads to the other requests
+                    return Response(None, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    headers={'Retry-After': str(int(timeout) or 1)})
+                events = broker.poll(pk, since, timeout)
+        return Response({'events': events, 'last_id': events[-1]['id'] if events else since})
+
+    @action(methods=['get'], detail=False, url_name='suggestions', url_path='suggestions')
+    def friendship_suggestions(self, arg):
+        """
+            List the people the user may know
+
+              parameters:
+                - name: limit
+                in: query
+                type: int
+                description: maximum number of suggestions
+        """
+        user = get_object_or_404(Profile, owner=self.request.user)
+        limit = self.request.query_params.get('limit', None)
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                return Response(None, status=status.HTTP_400_BAD_REQUEST)
+            if limit < 1:
+                return Response(None, status=status.HTTP_400_BAD_REQUEST)
+        suggestions = Suggestion.objects.suggestions(user, limit=limit)
+        serializer = SuggestionSerializer(suggestions, many=True, context={'request': self.request})
+        return Response(serializer.data)
+
+    @action(methods=['get'], detail=False, url_name='relationships', url_path='relationships')
+    def friendship_relationships(self, arg):
+        """
+            Relationship flags of the user with several profiles
+
+              parameters:
+                - name: profile_ids
+                in: query
+                type: string
+                description: comma separated Profiles ids
+        """
+        viewer = get_object_or_404(Profile, owner=self.request.user)
+        statuses = relationships(viewer, get_bulk_ids(self.request, 'profile_ids'))
+        return Response({'results': [dict(profile=pk, **flags) for pk, flags in sorted(statuses.items())]})
+
+    @action(methods=['post'], detail=False, url_name='add-friends', url_path='add_friends')
+    def friendship_add_friends(self, arg):
+        """
+            Create FriendshipRequests to several users
+
+              parameters:
+                - name: usernames
+                in: query
+                type: string
+                description: comma separated friends usernames, or a JSON list in the body
+        """
+        from_user = get_object_or_404(Profile, owner=self.request.user)
+        usernames, profiles = get_bulk_profiles(self.request)
+        outcomes = Friend.objects.add_friends(from_user, list(profiles.values()))
+        return bulk_response(usernames, profiles, outcomes)
+
+
+class FollowViewSet(ConditionalListMixin, CompactListMixin, viewsets.ReadOnlyModelViewSet):
     """
-        This viewset automatically provides `list`, `create`, `retrieve`,
-        `update` and `destroy` actions.
+        This viewset automatically provides `list` and `retrieve` actions.
+        Writes go through the actions below so they keep the caches, counters
+        and outbox in step.
 
           parameters:
             - name: following
             in: query
             type: bool
             description: Return follows
+
+            - name: compact
+            in: query
+            type: bool
+            description: Embed a profile summary instead of hyperlinks
     """
     serializer_class = FollowSerializer
+    compact_serializer_class = CompactFollowSerializer
+    cursor_ordering = ('-created', '-id')
 
     def get_queryset(self):
         """
@@ -196,6 +528,11 @@ class FollowViewSet(viewsets.ModelViewSet):
         else:
             return Follow.objects.filter(followee=self.request.user.profile).all()
 
+    def version_groups(self):
+        if self.request.query_params.get('following', None) is not None:
+            return ['following']
+        return ['followers']
+
     @action(methods=['post'], detail=False, url_name='add-follow', url_path='add_follow')
     def follower_add(self, arg):
         """
@@ -251,3 +588,35 @@ class FollowViewSet(viewsets.ModelViewSet):
                     content = {'code': 6002, 'message': 'Follower doesn\'t exist'}
                     return Response(content, status=status.HTTP_400_BAD_REQUEST)
         return Response(None, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(methods=['post'], detail=False, url_name='add-follows', url_path='add_follows')
+    def follower_add_many(self, arg):
+        """
+            Create following relationships to several users
+
+              parameters:
+                - name: usernames
+                in: query
+                type: string
+                description: comma separated usernames, or a JSON list in the body
+        """
+        follower = get_object_or_404(Profile, owner=self.request.user)
+        usernames, profiles = get_bulk_profiles(self.request)
+        outcomes = Follow.objects.add_followers(follower, list(profiles.values()))
+        return bulk_response(usernames, profiles, outcomes)
+
+    @action(methods=['post'], detail=False, url_name='remove-follows', url_path='remove_follows')
+    def follower_remove_many(self, arg):
+        """
+            Remove following relationships to several users
+
+              parameters:
+                - name: usernames
+                in: query
+                type: string
+                description: comma separated usernames, or a JSON list in the body
+        """
+        follower = get_object_or_404(Profile, owner=self.request.user)
+        usernames, profiles = get_bulk_profiles(self.request)
+        outcomes = Follow.objects.remove_followers(follower, list(profiles.values()))
+        return bulk_response(usernames, profiles, outcomes)
@@ -0,0 +1,17 @@
+from django.contrib.gis.db.models import GeometryField
+from django.db.models import FloatField, Func, Value
+
+
+class KNNDistance(Func):
+    """
+    PostGIS `<->` operator, ordering by it lets the planner walk the GiST index
+    of the geometry column instead of sorting every row. The value is planar
+    (degrees for srid 4326), use `Distance` for the real distance.
+    """
+    arg_joiner = ' <-> '
+    template = '%(expressions)s'
+    output_field = FloatField()
+
+    def __init__(self, expression, geom, **extra):
+        super(KNNDistance, self).__init__(expression, Value(geom, output_field=GeometryField(srid=geom.srid)),
+                                          **extra)
@@ -0,0 +1,65 @@
+# Generated by Django 2.0.6 on 2026-10-18 11:30
+
+import django.contrib.gis.db.models.fields
+from django.contrib.gis.geos import MultiPoint, Polygon
+from django.db import migrations, models
+
+import rest_geo.models
+
+
+def compute_route_geometry(apps, schema_editor):
+    Route = apps.get_model('rest_geo', 'Route')
+    for route in Route.objects.all():
+        locations = list(route.points.values_list('location', flat=True))
+        if locations:
+            geometry = MultiPoint(locations, srid=4326)
+            bbox = Polygon.from_bbox(geometry.extent)
+            bbox.srid = 4326
+            Route.objects.filter(pk=route.pk).update(geometry=geometry, bbox=bbox, centroid=geometry.centroid)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('rest_geo', '0004_auto_20180620_1643'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='route',
+            name='short_desc',
+            field=models.TextField(default='', max_length=200),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='zone',
+            field=models.TextField(default='', max_length=20),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='type',
+            field=models.CharField(choices=[(rest_geo.models.RouteType('Chasse au trésor'), 'Chasse au trésor'),
+                                            (rest_geo.models.RouteType('Parcour'), 'Parcour')],
+                                   default='', max_length=15),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='bbox',
+            field=django.contrib.gis.db.models.fields.PolygonField(blank=True, editable=False, null=True,
+                                                                   srid=4326),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='centroid',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, editable=False, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='route',
+            name='geometry',
+            field=django.contrib.gis.db.models.fields.MultiPointField(blank=True, editable=False, null=True,
+                                                                      srid=4326),
+        ),
+        migrations.RunPython(compute_route_geometry, migrations.RunPython.noop),
+    ]
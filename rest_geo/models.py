@@ -1,11 +1,25 @@
+import math
+import time
 from enum import Enum
 
+from django.conf import settings
 from django.contrib.gis.db import models
+from django.contrib.gis.db.models import Collect
+from django.contrib.gis.db.models.functions import Centroid, Distance as DistanceFunc, SnapToGrid
+from django.contrib.gis.geos import MultiPoint, Point, Polygon
+from django.contrib.gis.measure import Distance
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Count
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 # Create your models here.
 from rest_framework.reverse import reverse
 from taggit.managers import TaggableManager
 
+from rest_geo.functions import KNNDistance
 from rest_htags.models import Htags
 
 
@@ -14,6 +28,263 @@ class RouteType(Enum):   # A subclass of Enum
     PR = "Parcour"
 
 
+# Mean earth radius used by PostGIS ST_DistanceSphere, in km
+EARTH_RADIUS = 6370.986
+KM_PER_DEGREE = math.radians(EARTH_RADIUS)
+
+# Half the side of the Web Mercator square, in meters
+MERCATOR_EXTENT = 20037508.342789244
+MERCATOR_MAX_LAT = 85.0511287798
+MVT_MAX_ZOOM = 22
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+
+get_tile_size = lambda: getattr(settings, 'GEO_TILE_SIZE', 0.05)
+get_tile_max_count = lambda: getattr(settings, 'GEO_TILE_MAX_COUNT', 64)
+get_cluster_grid = lambda: getattr(settings, 'GEO_CLUSTER_GRID', 8)
+get_cluster_htags = lambda: getattr(settings, 'GEO_CLUSTER_HTAGS', 3)
+get_mvt_bust_max_tiles = lambda: getattr(settings, 'GEO_MVT_BUST_MAX_TILES', 64)
+get_geo_cache_alias = lambda: getattr(settings, 'GEO_CACHE_ALIAS', 'default')
+get_local_cache_timeout = lambda: getattr(settings, 'GEO_LOCAL_CACHE_TIMEOUT', 10)
+
+
+class GeoCache(object):
+    """
+    Proxy to the cache alias configured in GEO_CACHE_ALIAS
+    """
+
+    def __getattr__(self, name):
+        return getattr(caches[get_geo_cache_alias()], name)
+
+    def timeout(self, timeout=DEFAULT_TIMEOUT):
+        """
+        Busts only reach the process they run in with a LocMem backend, cap
+        the timeout of the cached values to GEO_LOCAL_CACHE_TIMEOUT then
+        """
+        backend = caches[get_geo_cache_alias()]
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = backend.default_timeout
+        if isinstance(backend, LocMemCache):
+            return get_local_cache_timeout() if timeout is None else min(timeout, get_local_cache_timeout())
+        return timeout
+
+
+cache = GeoCache()
+
+
+def tile_for(lng, lat):
+    """
+    Snap a coordinate to the (x, y) index of its cell in the tile grid
+    """
+    size = get_tile_size()
+    return int(math.floor(lng / size)), int(math.floor(lat / size))
+
+
+def tile_cache_key(tile):
+    """
+    Build the cache key of a tile
+    """
+    return 'poi-tile-%s-%s' % tile
+
+
+def bust_tile_cache(*locations):
+    """
+    Bust the cached tiles containing the given points
+    """
+    keys = {tile_cache_key(tile_for(location.x, location.y)) for location in locations if location is not None}
+    cache.delete_many(list(keys))
+
+
+def mvt_generation_key(z):
+    """
+    Build the cache key of the generation of a zoom level, tiles of a
+    previous generation are never read again and simply expire
+    """
+    return 'mvt-generation-%s' % z
+
+
+def mvt_cache_key(z, x, y, generation=None):
+    """
+    Build the cache key of a vector tile
+    """
+    if generation is None:
+        key = mvt_generation_key(z)
+        generation = cache.get(key)
+        if generation is None:
+            generation = int(time.time() * 1000)
+            cache.add(key, generation, None)
+            generation = cache.get(key, generation)
+    return 'mvt-%s-%s-%s-%s' % (generation, z, x, y)
+
+
+def to_mercator(lng, lat):
+    """ Convert a WGS84 (lng, lat) to Web Mercator meters """
+    lat = math.radians(min(max(lat, -MERCATOR_MAX_LAT), MERCATOR_MAX_LAT))
+    return lng / 180.0 * MERCATOR_EXTENT, math.log(math.tan(math.pi / 4 + lat / 2)) / math.pi * MERCATOR_EXTENT
+
+
+def mvt_tiles_covering(extent, z):
+    """
+    Return the x and y ranges of the tiles of zoom `z` whose buffered
+    bounds overlap a (min_lng, min_lat, max_lng, max_lat) extent
+    """
+    size = 2 * MERCATOR_EXTENT / 2 ** z
+    margin = size * TILE_BUFFER / TILE_EXTENT
+    min_mx, min_my = to_mercator(extent[0], extent[1])
+    max_mx, max_my = to_mercator(extent[2], extent[3])
+    cell = lambda value: min(max(int(math.floor(value / size)), 0), 2 ** z - 1)
+    xs = range(cell(MERCATOR_EXTENT + min_mx - margin), cell(MERCATOR_EXTENT + max_mx + margin) + 1)
+    ys = range(cell(MERCATOR_EXTENT - max_my - margin), cell(MERCATOR_EXTENT - min_my + margin) + 1)
+    return xs, ys
+
+
+def bust_mvt_cache(*geometries):
+    """
+    Bust the cached vector tiles showing any of the given geometries, the
+    zoom levels where that takes more than GEO_MVT_BUST_MAX_TILES tiles are
+    busted whole
+    """
+    extents = [geometry.extent for geometry in geometries if geometry is not None and not geometry.empty]
+    if not extents:
+        return
+    zooms = {mvt_generation_key(z): z for z in range(MVT_MAX_ZOOM + 1)}
+    # Zoom levels without a generation have no tile cached
+    generations = {zooms[key]: generation for key, generation in cache.get_many(list(zooms)).items()}
+
+    keys = set()
+    for z in sorted(generations):
+        ranges = [mvt_tiles_covering(extent, z) for extent in extents]
+        if sum(len(xs) * len(ys) for xs, ys in ranges) > get_mvt_bust_max_tiles():
+            # Deeper zoom levels cover even more tiles
+            for zoom in range(z, MVT_MAX_ZOOM + 1):
+                try:
+                    cache.incr(mvt_generation_key(zoom))
+                except ValueError:
+                    pass
+            break
+        keys.update(mvt_cache_key(z, x, y, generations[z]) for xs, ys in ranges for x in xs for y in ys)
+    cache.delete_many(list(keys))
+
+
+def degrees_around(lat, radius):
+    """
+    Return the (lng, lat) half-sizes in degrees of a box enclosing every
+    point within `radius` km of latitude `lat`
+    """
+    lat_delta = radius / KM_PER_DEGREE
+    lng_delta = lat_delta / max(math.cos(math.radians(min(abs(lat) + lat_delta, 90.0))), 0.01)
+    return lng_delta, lat_delta
+
+
+def haversine(lng1, lat1, lng2, lat2):
+    """ Great-circle distance in km between two points """
+    lng1, lat1, lng2, lat2 = map(math.radians, (lng1, lat1, lng2, lat2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class PointOfInterestManager(models.Manager):
+    """ PointOfInterest manager """
+
+    def nearby(self, lng, lat, radius):
+        """
+        Return the POIs within `radius` km of the point, the matching ids are
+        read from the tile cache and only missing tiles hit the spatial index
+        """
+        lng, lat, radius = float(lng), float(lat), float(radius)
+        lng_delta, lat_delta = degrees_around(lat, radius)
+        min_x, min_y = tile_for(max(lng - lng_delta, -180.0), max(lat - lat_delta, -90.0))
+        max_x, max_y = tile_for(min(lng + lng_delta, 180.0), min(lat + lat_delta, 90.0))
+        tiles = [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+        if len(tiles) > get_tile_max_count():
+            location = Point(lng, lat, srid=4326)
+            return self.filter(location__distance_lte=(location, Distance(km=radius)))
+
+        keys = {tile_cache_key(tile): tile for tile in tiles}
+        cached = cache.get_many(list(keys))
+        missing = [tile for key, tile in keys.items() if key not in cached]
+        if missing:
+            cached.update(self._fill_tiles(missing))
+
+        ids = [pk for points in cached.values() for pk, x, y in points
+               if haversine(lng, lat, x, y) <= radius]
+        return self.filter(pk__in=ids)
+
+    def in_bbox(self, bbox, exclude_bbox=None):
+        """
+        Return the POIs inside `bbox` but not inside `exclude_bbox`, both are
+        index-only `&&` comparisons
+        """
+        qs = self.filter(location__bboverlaps=bbox)
+        if exclude_bbox is not None:
+            qs = qs.exclude(location__bboverlaps=exclude_bbox)
+        return qs
+
+    def nearest(self, lng, lat, limit, max_distance=None):
+        """
+        Return the `limit` POIs closest to the point, annotated with their
+        `distance`, optionally no further than `max_distance` km
+        """
+        location = Point(float(lng), float(lat), srid=4326)
+        limit = int(limit)
+        qs = self.annotate(distance=DistanceFunc('location', location))
+        if max_distance is not None:
+            qs = qs.filter(location__distance_lte=(location, Distance(km=float(max_distance))))
+
+        # `<->` is planar in degrees and misorders points away from the
+        # equator, it only picks `limit` candidates from the index. The true
+        # nearest ones are all within the furthest candidate's distance.
+        candidates = list(qs.order_by(KNNDistance('location', location)).values_list('distance', flat=True)[:limit])
+        if len(candidates) == limit:
+            radius = max(distance.km for distance in candidates)
+            lng_delta, lat_delta = degrees_around(location.y, radius)
+            box = Polygon.from_bbox((location.x - lng_delta, location.y - lat_delta,
+                                     location.x + lng_delta, location.y + lat_delta))
+            box.srid = 4326
+            qs = qs.filter(location__bboverlaps=box, location__distance_lte=(location, Distance(km=radius)))
+        return qs.order_by('distance', 'pk')[:limit]
+
+    def clusters(self, bbox, zoom):
+        """
+        Group the POIs of `bbox` on a grid sized for the map `zoom` level,
+        return a list of clusters with their centroid, count and top htags
+        """
+        size = 360.0 / (2 ** int(zoom)) / get_cluster_grid()
+        qs = self.filter(location__contained=bbox).annotate(cell=SnapToGrid('location', size)).order_by()
+
+        clusters = {}
+        for cluster in qs.values('cell').annotate(count=Count('pk'), center=Centroid(Collect('location'))):
+            clusters[cluster['cell'].coords] = {'location': cluster['center'], 'count': cluster['count'],
+                                                'htags': []}
+
+        tags = qs.filter(htags__name__isnull=False).values('cell', 'htags__name').annotate(count=Count('pk'))
+        for tag in sorted(tags, key=lambda tag: (-tag['count'], tag['htags__name'])):
+            htags = clusters[tag['cell'].coords]['htags']
+            if len(htags) < get_cluster_htags():
+                htags.append(tag['htags__name'])
+
+        return list(clusters.values())
+
+    def _fill_tiles(self, tiles):
+        """ Load the given tiles with a single envelope query and cache them """
+        size = get_tile_size()
+        min_x = min(x for x, y in tiles)
+        min_y = min(y for x, y in tiles)
+        max_x = max(x for x, y in tiles)
+        max_y = max(y for x, y in tiles)
+        envelope = Polygon.from_bbox((min_x * size, min_y * size, (max_x + 1) * size, (max_y + 1) * size))
+        envelope.srid = 4326
+
+        filled = {tile_cache_key(tile): [] for tile in tiles}
+        for pk, location in self.filter(location__contained=envelope).values_list('pk', 'location'):
+            key = tile_cache_key(tile_for(location.x, location.y))
+            if key in filled:
+                filled[key].append((pk, location.x, location.y))
+        cache.set_many(filled, cache.timeout())
+        return filled
+
+
 class PointOfInterest(models.Model):
     """ Model to represent POIs"""
 
@@ -23,6 +294,8 @@ class PointOfInterest(models.Model):
     img = models.ImageField(max_length=None, null=True, blank=True)
     htags = TaggableManager(blank=True, through=Htags)
 
+    objects = PointOfInterestManager()
+
     def __str__(self):
         return self.title
 
@@ -34,17 +307,54 @@ class PointOfInterest(models.Model):
         verbose_name_plural = _('PointOfInterest')
         ordering = ('title',)
 
+
+class RouteManager(models.Manager):
+    """ Route manager """
+
+    def nearby(self, lng, lat, radius):
+        """
+        Return the routes passing within `radius` km of the point, the planar
+        DWithin prefilter runs on the GiST index of the route geometry
+        """
+        lng, lat, radius = float(lng), float(lat), float(radius)
+        location = Point(lng, lat, srid=4326)
+        return self.filter(geometry__dwithin=(location, math.hypot(*degrees_around(lat, radius))),
+                           geometry__distance_lte=(location, Distance(km=radius)))
+
+    def in_bbox(self, bbox, exclude_bbox=None):
+        """
+        Return the routes whose bounding box overlaps `bbox` but not `exclude_bbox`,
+        both are index-only `&&` comparisons
+        """
+        qs = self.filter(geometry__bboverlaps=bbox)
+        if exclude_bbox is not None:
+            qs = qs.exclude(geometry__bboverlaps=exclude_bbox)
+        return qs
+
+    def update_geometries(self, route_ids):
+        """ Recompute the geometry of the given routes """
+        for route in self.filter(pk__in=route_ids):
+            route.update_geometry()
+
+
 class Route(models.Model):
     """ Model to represent Routes """
 
     title = models.CharField(max_length=60)
     description = models.TextField(max_length=500, blank=True, null=True)
-    short_desc = models.TextField(max_lenth = 200, blank= False, null=False)
-    zone = models.TextField(max_lenth = 20, blank= False, null=False)
+    short_desc = models.TextField(max_length=200, blank=False, null=False)
+    zone = models.TextField(max_length=20, blank=False, null=False)
     type = models.CharField(max_length=15, choices = [(tag, tag.value) for tag in RouteType])  # Choices is a list of Tuple
     img = models.ImageField(max_length=None, null=True, blank=True)
     points = models.ManyToManyField(PointOfInterest, related_name='routes')
     htags = TaggableManager(blank=True, through=Htags)
+    # Denormalized from `points`, maintained by the signals below
+    geometry = models.MultiPointField(null=True, blank=True, editable=False)
+    bbox = models.PolygonField(null=True, blank=True, editable=False)
+    centroid = models.PointField(null=True, blank=True, editable=False)
+    GEOMETRIES = ('geometry', 'bbox', 'centroid')
+
+    objects = RouteManager()
 
     def __str__(self):
         return self.title
@@ -52,7 +362,88 @@ class Route(models.Model):
     def get_absolute_url(self):
         return reverse('route-detail', args=[str(self.id)])
 
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        # The geometries are only written by update_geometry, never save stale in-memory values over them
+        if update_fields is None and not force_insert and not self._state.adding:
+            update_fields = [field.name for field in self._meta.concrete_fields
+                             if not field.primary_key and field.name not in self.GEOMETRIES]
+        super(Route, self).save(force_insert, force_update, using, update_fields)
+
+    def update_geometry(self):
+        """ Recompute geometry, bbox and centroid from the route points """
+        previous = Route.objects.filter(pk=self.pk).values_list('bbox', flat=True).first()
+        locations = list(self.points.values_list('location', flat=True))
+        if locations:
+            self.geometry = MultiPoint(locations, srid=4326)
+            self.bbox = Polygon.from_bbox(self.geometry.extent)
+            self.bbox.srid = 4326
+            self.centroid = self.geometry.centroid
+        else:
+            self.geometry = self.bbox = self.centroid = None
+        Route.objects.filter(pk=self.pk).update(geometry=self.geometry, bbox=self.bbox, centroid=self.centroid)
+        bust_mvt_cache(previous, self.bbox)
+
     class Meta:
         verbose_name = _('Route')
         verbose_name_plural = _('Routes')
         ordering = ('title',)
+
+
+@receiver(pre_save, sender=PointOfInterest)
+def bust_previous_poi_tile(sender, instance, **kwargs):
+    instance._moved = False
+    instance._previous_location = None
+    if instance.pk:
+        previous = PointOfInterest.objects.filter(pk=instance.pk).values_list('location', flat=True).first()
+        if previous is not None and previous != instance.location:
+            instance._moved = True
+            instance._previous_location = previous
+            bust_tile_cache(previous)
+
+
+@receiver(post_save, sender=PointOfInterest)
+@receiver(post_delete, sender=PointOfInterest)
+def bust_poi_tile(sender, instance, **kwargs):
+    bust_tile_cache(instance.location)
+
+
+@receiver(post_save, sender=PointOfInterest)
+@receiver(post_delete, sender=PointOfInterest)
+def bust_poi_mvt(sender, instance, **kwargs):
+    bust_mvt_cache(instance.location, getattr(instance, '_previous_location', None))
+
+
+@receiver(post_save, sender=Route)
+@receiver(post_delete, sender=Route)
+def bust_route_mvt(sender, instance, **kwargs):
+    bust_mvt_cache(instance.bbox)
+
+
+@receiver(post_save, sender=PointOfInterest)
+def update_poi_routes_geometry(sender, instance, created, **kwargs):
+    if getattr(instance, '_moved', False):
+        Route.objects.update_geometries(instance.routes.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=PointOfInterest)
+def store_poi_routes(sender, instance, **kwargs):
+    # The m2m rows are deleted without m2m_changed, keep the routes for post_delete
+    instance._route_ids = list(instance.routes.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=PointOfInterest)
+def update_deleted_poi_routes_geometry(sender, instance, **kwargs):
+    Route.objects.update_geometries(getattr(instance, '_route_ids', []))
+
+
+@receiver(m2m_changed, sender=Route.points.through)
+def update_route_geometry(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            instance.update_geometry()
+    elif action == 'pre_clear':
+        instance._route_ids = list(instance.routes.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        Route.objects.update_geometries(instance._route_ids)
+    elif action in ('post_add', 'post_remove'):
+        Route.objects.update_geometries(pk_set)
@@ -20,13 +20,23 @@ class PointOfInterestSerializer(TaggitSerializer, SerializerErrorMessagesMixin,
         fields = "__all__"
 
 
+class NearestPointOfInterestSerializer(PointOfInterestSerializer):
+    distance = serializers.FloatField(source='distance.km', read_only=True)
+
+
+class PointOfInterestClusterSerializer(serializers.Serializer):
+    location = PointField(read_only=True)
+    count = serializers.IntegerField(read_only=True)
+    htags = serializers.ListField(child=serializers.CharField(), read_only=True)
+
+
 class RouteSerializer(TaggitSerializer, SerializerErrorMessagesMixin, serializers.HyperlinkedModelSerializer):
     img = Base64ImageField(required=False)
     htags = TagListSerializerField()
-    location = PointField(required=False)
-    pois = serializers.HyperlinkedRelatedField(many=True, view_name='pointofinterest-detail',
-                                               queryset=PointOfInterest.objects.all())
+    centroid = PointField(read_only=True)
+    pois = serializers.HyperlinkedRelatedField(many=True, read_only=True, source='points',
+                                               view_name='pointofinterest-detail')
 
     class Meta:
         model = Route
-        fields = "__all__"
+        exclude = ('geometry', 'bbox')
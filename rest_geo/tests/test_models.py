@@ -2,13 +2,12 @@
 
 #  Core Django imports
 from django.contrib.auth.models import User
-from django.contrib.gis.geos import GEOSGeometry
-from django.core.cache import cache
-from django.test import RequestFactory
+from django.contrib.gis.geos import GEOSGeometry, Polygon
+from django.test import RequestFactory, override_settings
 # Third-party app imports
 from rest_framework.test import APITestCase, APIClient
 
-from rest_geo.models import PointOfInterest, Route
+from rest_geo.models import PointOfInterest, Route, cache, mvt_cache_key, mvt_tiles_covering, tile_cache_key, tile_for
 
 
 class BaseTestCase(APITestCase):
@@ -71,6 +70,141 @@ class PointOfInterestModelTests(BaseTestCase):
         self.assertEquals(self.poi.get_absolute_url(), '/pointofinterest/' + str(self.poi.id) + '/')
 
 
+class PointOfInterestNearbyTests(BaseTestCase):
+
+    def setUp(self):
+        super(PointOfInterestNearbyTests, self).setUp()
+        self.poi_far = PointOfInterest.objects.create(title='Far', description='Test',
+                                                      location=GEOSGeometry('POINT(1 1)', srid=4326))
+
+    def test_nearby(self):
+        self.assertEqual(list(PointOfInterest.objects.nearby(0.001, 0.001, 1)), [self.poi])
+        self.assertEqual(list(PointOfInterest.objects.nearby(0.5, 0.5, 200)), [self.poi_far, self.poi])
+
+    def test_nearby_uses_tile_cache(self):
+        PointOfInterest.objects.nearby(0, 0, 1)
+        self.assertEqual(cache.get(tile_cache_key(tile_for(0, 0))), [(self.poi.pk, 0.0, 0.0)])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(list(PointOfInterest.objects.nearby(0, 0, 1)), [self.poi])
+
+    def test_nearby_tile_invalidation(self):
+        PointOfInterest.objects.nearby(0, 0, 1)
+
+        # A new POI busts its tile
+        poi = PointOfInterest.objects.create(title='New', location=GEOSGeometry('POINT(0.001 0.001)', srid=4326))
+        self.assertIsNone(cache.get(tile_cache_key(tile_for(0, 0))))
+        self.assertEqual(list(PointOfInterest.objects.nearby(0, 0, 1)), [poi, self.poi])
+
+        # Moving a POI busts both the previous and the new tile
+        PointOfInterest.objects.nearby(1, 1, 1)
+        poi.location = GEOSGeometry('POINT(1.001 1.001)', srid=4326)
+        poi.save()
+        self.assertIsNone(cache.get(tile_cache_key(tile_for(0, 0))))
+        self.assertIsNone(cache.get(tile_cache_key(tile_for(1, 1))))
+        self.assertEqual(list(PointOfInterest.objects.nearby(0, 0, 1)), [self.poi])
+        self.assertEqual(list(PointOfInterest.objects.nearby(1, 1, 1)), [self.poi_far, poi])
+
+        # Deleting a POI busts its tile
+        poi.delete()
+        self.assertIsNone(cache.get(tile_cache_key(tile_for(1, 1))))
+        self.assertEqual(list(PointOfInterest.objects.nearby(1, 1, 1)), [self.poi_far])
+
+
+class VectorTileCacheTests(BaseTestCase):
+
+    def test_bust_mvt_cache(self):
+        paris = GEOSGeometry('POINT(2.35 48.85)', srid=4326)
+        xs, ys = mvt_tiles_covering(paris.extent, 10)
+        near, far = mvt_cache_key(10, xs[0], ys[0]), mvt_cache_key(10, 0, 0)
+        cache.set_many({near: 'tile', far: 'tile'})
+
+        # Only the tiles showing the new POI are busted
+        PointOfInterest.objects.create(title='Paris', location=paris)
+        self.assertIsNone(cache.get(near))
+        self.assertEqual(cache.get(far), 'tile')
+
+    @override_settings(GEO_MVT_BUST_MAX_TILES=4)
+    def test_bust_mvt_cache_zoom(self):
+        poi_far = PointOfInterest.objects.create(title='Far', location=GEOSGeometry('POINT(40 40)', srid=4326))
+        keys = [mvt_cache_key(z, 0, 0) for z in (0, 8)]
+        cache.set_many(dict.fromkeys(keys, 'tile'))
+
+        # The route spans too many tiles at zoom 8, the whole level is busted
+        self.route.points.add(self.poi, poi_far)
+        self.assertIsNone(cache.get(keys[0]))
+        self.assertNotEqual(mvt_cache_key(8, 0, 0), keys[1])
+
+
+class PointOfInterestBboxTests(BaseTestCase):
+
+    def test_in_bbox(self):
+        poi_far = PointOfInterest.objects.create(title='Far', location=GEOSGeometry('POINT(1 1)', srid=4326))
+        bbox = Polygon.from_bbox((-1, -1, 2, 2))
+        bbox.srid = 4326
+        seen = Polygon.from_bbox((-2, -2, 0.5, 0.5))
+        seen.srid = 4326
+
+        self.assertEqual(list(PointOfInterest.objects.in_bbox(bbox)), [poi_far, self.poi])
+        self.assertEqual(list(PointOfInterest.objects.in_bbox(bbox, exclude_bbox=seen)), [poi_far])
+
+
+class PointOfInterestNearestTests(BaseTestCase):
+
+    def setUp(self):
+        super(PointOfInterestNearestTests, self).setUp()
+        self.poi_near = PointOfInterest.objects.create(title='Near', description='Test',
+                                                       location=GEOSGeometry('POINT(0.1 0.1)', srid=4326))
+        self.poi_far = PointOfInterest.objects.create(title='Far', description='Test',
+                                                      location=GEOSGeometry('POINT(1 1)', srid=4326))
+
+    def test_nearest(self):
+        self.assertEqual(list(PointOfInterest.objects.nearest(0.2, 0.2, 3)), [self.poi_near, self.poi, self.poi_far])
+        self.assertEqual(list(PointOfInterest.objects.nearest(0.9, 0.9, 2)), [self.poi_far, self.poi_near])
+
+    def test_nearest_distance(self):
+        pois = list(PointOfInterest.objects.nearest(0, 0, 3, max_distance=20))
+        self.assertEqual(pois, [self.poi, self.poi_near])
+        self.assertEqual(pois[0].distance.km, 0)
+        self.assertAlmostEqual(pois[1].distance.km, 15.7, places=0)
+
+    def test_nearest_high_latitude(self):
+        # At latitude 60 one degree east (~56 km) is closer than 0.6 degree
+        # north (~67 km), though further in planar degrees
+        east = PointOfInterest.objects.create(title='East', location=GEOSGeometry('POINT(11 60)', srid=4326))
+        north = PointOfInterest.objects.create(title='North', location=GEOSGeometry('POINT(10 60.6)', srid=4326))
+        self.assertEqual(list(PointOfInterest.objects.nearest(10, 60, 1)), [east])
+        self.assertEqual(list(PointOfInterest.objects.nearest(10, 60, 2)), [east, north])
+
+
+class PointOfInterestClusterTests(BaseTestCase):
+
+    def setUp(self):
+        super(PointOfInterestClusterTests, self).setUp()
+        self.poi.htags.add('museum')
+        self.poi_near = PointOfInterest.objects.create(title='Near', location=GEOSGeometry('POINT(0.2 0.2)', srid=4326))
+        self.poi_near.htags.add('museum', 'park')
+        self.poi_far = PointOfInterest.objects.create(title='Far', location=GEOSGeometry('POINT(20 20)', srid=4326))
+        self.bbox = Polygon.from_bbox((-40, -40, 40, 40))
+        self.bbox.srid = 4326
+
+    def test_clusters(self):
+        clusters = sorted(PointOfInterest.objects.clusters(self.bbox, 2), key=lambda cluster: cluster['count'])
+        self.assertEqual(len(clusters), 2)
+        self.assertEqual(clusters[0]['count'], 1)
+        self.assertEqual(clusters[0]['location'].coords, (20, 20))
+        self.assertEqual(clusters[0]['htags'], [])
+        self.assertEqual(clusters[1]['count'], 2)
+        self.assertAlmostEqual(clusters[1]['location'].x, 0.1)
+        self.assertEqual(clusters[1]['htags'], ['museum', 'park'])
+
+    def test_clusters_zoom(self):
+        # Zoomed in, every POI gets its own cluster
+        self.assertEqual(len(PointOfInterest.objects.clusters(self.bbox, 12)), 3)
+        # Zoomed out, everything lands in the same cell
+        self.assertEqual(len(PointOfInterest.objects.clusters(self.bbox, 0)), 1)
+
+
 class RouteModelTests(BaseTestCase):
 
     def setUp(self):
@@ -83,3 +217,51 @@ class RouteModelTests(BaseTestCase):
     def test_get_absolute_url(self):
         # This will also fail if the urlconf is not defined.
         self.assertEquals(self.route.get_absolute_url(), '/route/' + str(self.route.id) + '/')
+
+    def test_nearby(self):
+        poi_far = PointOfInterest.objects.create(title='Far', location=GEOSGeometry('POINT(1 1)', srid=4326))
+        route_far = Route.objects.create(title='Far')
+        route_far.points.add(poi_far)
+        self.route.points.add(self.poi, poi_far)
+
+        self.assertEqual(list(Route.objects.nearby(0.001, 0.001, 1)), [self.route])
+        self.assertEqual(list(Route.objects.nearby(1, 1, 1)), [route_far, self.route])
+        self.assertEqual(list(Route.objects.nearby(0.5, 0.5, 1)), [])
+
+    def test_geometry(self):
+        poi = PointOfInterest.objects.create(title='Other', location=GEOSGeometry('POINT(2 2)', srid=4326))
+        self.route.points.add(self.poi, poi)
+        self.route.refresh_from_db()
+        self.assertEqual(self.route.geometry.extent, (0, 0, 2, 2))
+        self.assertEqual(self.route.bbox.extent, (0, 0, 2, 2))
+        self.assertEqual(self.route.centroid.coords, (1, 1))
+
+        # Moving a point updates the route
+        poi.location = GEOSGeometry('POINT(4 4)', srid=4326)
+        poi.save()
+        # Saving a stale route instance doesn't write its old geometry back
+        self.route.title = 'Renamed'
+        self.route.save()
+        self.route.refresh_from_db()
+        self.assertEqual(self.route.title, 'Renamed')
+        self.assertEqual(self.route.centroid.coords, (2, 2))
+
+        # Removing points from either side updates the route
+        poi.routes.remove(self.route)
+        self.route.refresh_from_db()
+        self.assertEqual(self.route.centroid.coords, (0, 0))
+
+        self.poi.delete()
+        self.route.refresh_from_db()
+        self.assertIsNone(self.route.geometry)
+        self.assertIsNone(self.route.centroid)
+
+    def test_in_bbox(self):
+        self.route.points.add(self.poi)
+        bbox = Polygon.from_bbox((-1, -1, 1, 1))
+        bbox.srid = 4326
+        seen = Polygon.from_bbox((-2, -2, 0.5, 0.5))
+        seen.srid = 4326
+
+        self.assertEqual(list(Route.objects.in_bbox(bbox)), [self.route])
+        self.assertEqual(list(Route.objects.in_bbox(bbox, exclude_bbox=seen)), [])
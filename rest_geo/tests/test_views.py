@@ -1,8 +1,23 @@
 from django.contrib.auth.models import User
-from django.core.cache import cache
+from django.contrib.gis.geos import GEOSGeometry
 from django.test import RequestFactory
+from django.utils.http import urlencode
+from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase, APIClient
 
+from rest_geo.models import PointOfInterest, cache
+
+
+def reverse_querystring(view, urlconf=None, args=None, kwargs=None, current_app=None, query_kwargs=None):
+    """Custom reverse to handle query strings.
+    Usage:
+        reverse('app.views.my_view', kwargs={'pk': 123}, query_kwargs={'search', 'Bob'})
+    """
+    base_url = reverse(view, urlconf=urlconf, args=args, kwargs=kwargs, current_app=current_app)
+    if query_kwargs:
+        return '{}?{}'.format(base_url, urlencode(query_kwargs))
+    return base_url
+
 
 class BaseTestCase(APITestCase):
 
@@ -51,7 +66,84 @@ class PointOfInterestViewTests(BaseTestCase):
 
     def setUp(self):
         super(PointOfInterestViewTests, self).setUp()
-    # TODO METHOD TEST
+        self.poi = PointOfInterest.objects.create(title='Test', description='Test',
+                                                  location=GEOSGeometry('POINT(0 0)', srid=4326))
+        self.poi_far = PointOfInterest.objects.create(title='Far', description='Test',
+                                                      location=GEOSGeometry('POINT(1 1)', srid=4326))
+
+    def test_bbox(self):
+        url = reverse_querystring('pointofinterest-list',
+                                  query_kwargs={'bbox': '-1,-1,2,2', 'exclude_bbox': '-1,-1,0.5,0.5'})
+
+        # test that the view requires authentication to access it
+        response = self.client.get(url)
+        self.assertResponse401(response)
+
+        self.client.force_authenticate(self.user_bob)
+        response = self.client.get(url)
+        self.assertResponse200(response)
+        self.assertEqual([poi['id'] for poi in response.data['results']], [self.poi_far.id])
+
+        url = reverse_querystring('pointofinterest-list', query_kwargs={'bbox': 'foo'})
+        response = self.client.get(url)
+        self.assertResponse400(response)
+        self.client.force_authenticate()
+
+    def test_nearest(self):
+        url = reverse_querystring('pointofinterest-nearest', query_kwargs={'lng': 0, 'lat': 0, 'limit': 1})
+
+        # test that the view requires authentication to access it
+        response = self.client.get(url)
+        self.assertResponse401(response)
+
+        self.client.force_authenticate(self.user_bob)
+        response = self.client.get(url)
+        self.assertResponse200(response)
+        self.assertEqual([poi['id'] for poi in response.data], [self.poi.id])
+        self.assertEqual(response.data[0]['distance'], 0)
+
+        url = reverse_querystring('pointofinterest-nearest', query_kwargs={'lng': 0, 'lat': 0, 'max_distance': 100})
+        response = self.client.get(url)
+        self.assertResponse200(response)
+        self.assertEqual([poi['id'] for poi in response.data], [self.poi.id])
+
+        url = reverse_querystring('pointofinterest-nearest', query_kwargs={'lng': 0, 'lat': 0, 'limit': -1})
+        response = self.client.get(url)
+        self.assertResponse200(response)
+        self.assertEqual([poi['id'] for poi in response.data], [self.poi.id])
+
+        for query_kwargs in ({'lng': 'a', 'lat': 0}, {'lng': 0, 'lat': 0, 'limit': 'a'},
+                             {'lng': 0, 'lat': 0, 'max_distance': 'a'}):
+            response = self.client.get(reverse_querystring('pointofinterest-nearest', query_kwargs=query_kwargs))
+            self.assertResponse400(response)
+
+        response = self.client.get(reverse('pointofinterest-nearest'))
+        self.assertResponse400(response)
+        self.client.force_authenticate()
+
+    def test_clusters(self):
+        url = reverse_querystring('pointofinterest-clusters', query_kwargs={'bbox': '-5,-5,5,5', 'zoom': 4})
+
+        # test that the view requires authentication to access it
+        response = self.client.get(url)
+        self.assertResponse401(response)
+
+        self.client.force_authenticate(self.user_bob)
+        response = self.client.get(url)
+        self.assertResponse200(response)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['count'], 2)
+        self.assertEqual(response.data[0]['htags'], [])
+        self.assertEqual(float(response.data[0]['location']['latitude']), 0.5)
+        self.assertEqual(float(response.data[0]['location']['longitude']), 0.5)
+
+        url = reverse_querystring('pointofinterest-clusters', query_kwargs={'bbox': '-5,-5,5', 'zoom': 4})
+        response = self.client.get(url)
+        self.assertResponse400(response)
+
+        response = self.client.get(reverse('pointofinterest-clusters'))
+        self.assertResponse400(response)
+        self.client.force_authenticate()
 
 
 class RouteViewTests(BaseTestCase):
@@ -59,3 +151,39 @@ class RouteViewTests(BaseTestCase):
     def setUp(self):
         super(RouteViewTests, self).setUp()
     # TODO METHOD TEST
+
+
+class TileViewTests(BaseTestCase):
+
+    def setUp(self):
+        super(TileViewTests, self).setUp()
+        self.poi = PointOfInterest.objects.create(title='Test', description='Test',
+                                                  location=GEOSGeometry('POINT(2.35 48.85)', srid=4326))
+
+    def test_tile(self):
+        url = reverse('tile', kwargs={'z': 0, 'x': 0, 'y': 0})
+
+        # test that the view requires authentication to access it
+        response = self.client.get(url)
+        self.assertResponse401(response)
+
+        self.client.force_authenticate(self.user_bob)
+        response = self.client.get(url)
+        self.assertResponse200(response)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn(b'pointofinterest', response.content)
+        etag = response['ETag']
+
+        # unchanged tiles are not sent again
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # changes inside the tile invalidate it
+        PointOfInterest.objects.create(title='Other', location=GEOSGeometry('POINT(2.36 48.86)', srid=4326))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertResponse200(response)
+        self.assertNotEqual(response['ETag'], etag)
+
+        response = self.client.get(reverse('tile', kwargs={'z': 1, 'x': 2, 'y': 0}))
+        self.assertResponse404(response)
+        self.client.force_authenticate()
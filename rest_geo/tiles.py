@@ -0,0 +1,75 @@
+import hashlib
+import math
+
+from django.conf import settings
+from django.db import connection
+
+from rest_geo.models import PointOfInterest, Route, cache, mvt_cache_key, MERCATOR_EXTENT, TILE_BUFFER, TILE_EXTENT
+
+get_mvt_cache_timeout = lambda: getattr(settings, 'GEO_MVT_CACHE_TIMEOUT', 60 * 60 * 24)
+
+TILE_SQL = """
+SELECT COALESCE((
+    SELECT ST_AsMVT(pois, 'pointofinterest', {extent}, 'geom') FROM (
+        SELECT id, title, ST_AsMVTGeom(ST_Transform(location, 3857), {bounds}, {extent}, {buffer}, true) AS geom
+        FROM {poi_table}
+        WHERE location && {envelope}
+    ) AS pois
+), ''::bytea) || COALESCE((
+    SELECT ST_AsMVT(routes, 'route', {extent}, 'geom') FROM (
+        SELECT id, title, type, ST_AsMVTGeom(ST_Transform(geometry, 3857), {bounds}, {extent}, {buffer}, true) AS geom
+        FROM {route_table}
+        WHERE geometry && {envelope}
+    ) AS routes
+), ''::bytea)
+"""
+
+
+def tile_bounds(z, x, y):
+    """ Web Mercator bounds of the tile (minx, miny, maxx, maxy) """
+    size = 2 * MERCATOR_EXTENT / 2 ** z
+    return (-MERCATOR_EXTENT + x * size, MERCATOR_EXTENT - (y + 1) * size,
+            -MERCATOR_EXTENT + (x + 1) * size, MERCATOR_EXTENT - y * size)
+
+
+def to_lng_lat(mx, my):
+    """ Convert Web Mercator meters to a WGS84 (lng, lat) """
+    lng = mx / MERCATOR_EXTENT * 180.0
+    lat = math.degrees(2 * math.atan(math.exp(my / MERCATOR_EXTENT * math.pi)) - math.pi / 2)
+    return lng, lat
+
+
+def render_tile(z, x, y):
+    """
+    Encode the POI and route layers of a tile with ST_AsMVT (PostGIS >= 2.4)
+    """
+    bounds = tile_bounds(z, x, y)
+    margin = (bounds[2] - bounds[0]) * TILE_BUFFER / TILE_EXTENT
+    min_lng, min_lat = to_lng_lat(max(bounds[0] - margin, -MERCATOR_EXTENT), max(bounds[1] - margin, -MERCATOR_EXTENT))
+    max_lng, max_lat = to_lng_lat(min(bounds[2] + margin, MERCATOR_EXTENT), min(bounds[3] + margin, MERCATOR_EXTENT))
+
+    sql = TILE_SQL.format(
+        extent=TILE_EXTENT,
+        buffer=TILE_BUFFER,
+        bounds='ST_MakeEnvelope(%s, %s, %s, %s, 3857)',
+        envelope='ST_MakeEnvelope(%s, %s, %s, %s, 4326)',
+        poi_table=connection.ops.quote_name(PointOfInterest._meta.db_table),
+        route_table=connection.ops.quote_name(Route._meta.db_table),
+    )
+    envelope = (min_lng, min_lat, max_lng, max_lat)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, bounds + envelope + bounds + envelope)
+        return bytes(cursor.fetchone()[0])
+
+
+def get_tile(z, x, y):
+    """ Return the (data, etag) of a tile, from the cache when possible """
+    key = mvt_cache_key(z, x, y)
+    tile = cache.get(key)
+
+    if tile is None:
+        data = render_tile(z, x, y)
+        tile = (data, hashlib.md5(data).hexdigest())
+        cache.set(key, tile, cache.timeout(get_mvt_cache_timeout()))
+
+    return tile
@@ -0,0 +1,12 @@
+"""rest_geo URL Configuration
+
+The `urlpatterns` list routes URLs to views. For more information please see:
+    https://docs.djangoproject.com/en/1.11/topics/http/urls/
+"""
+
+from django.conf.urls import url
+from rest_geo.views import TileView
+
+urlpatterns = [
+    url(r'^(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.mvt$', TileView.as_view(), name='tile'),
+]
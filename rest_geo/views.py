@@ -1,11 +1,32 @@
 # Create your views here.
-from django.contrib.gis.geos import fromstr
-from django.contrib.gis.measure import Distance
-from rest_framework import viewsets
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from rest_geo.models import PointOfInterest, Route
-from rest_geo.serializers import PointOfInterestSerializer, RouteSerializer
+from rest_geo.serializers import PointOfInterestSerializer, RouteSerializer, NearestPointOfInterestSerializer, \
+    PointOfInterestClusterSerializer
+from rest_geo.tiles import get_tile
+
+get_nearest_default_limit = lambda: getattr(settings, 'GEO_NEAREST_DEFAULT_LIMIT', 20)
+get_nearest_max_limit = lambda: getattr(settings, 'GEO_NEAREST_MAX_LIMIT', 100)
+
+
+def parse_bbox(value):
+    """ Build a polygon from a `minx,miny,maxx,maxy` query parameter """
+    try:
+        bbox = Polygon.from_bbox([float(coord) for coord in value.split(',')])
+    except (TypeError, ValueError):
+        raise ParseError('bbox must be formatted as minx,miny,maxx,maxy')
+    bbox.srid = 4326
+    return bbox
 
 
 class PointOfInterestViewSet(viewsets.ModelViewSet):
@@ -32,6 +53,15 @@ class PointOfInterestViewSet(viewsets.ModelViewSet):
         required: true
         description: Origin point latitude
 
+        - name: bbox
+        in: query
+        type: string
+        description: Bounding box as minx,miny,maxx,maxy, replaces lat/lng/radius
+
+        - name: exclude_bbox
+        in: query
+        type: string
+        description: Already fetched bounding box as minx,miny,maxx,maxy
     """
 
     queryset = PointOfInterest.objects.all()
@@ -44,13 +74,93 @@ class PointOfInterestViewSet(viewsets.ModelViewSet):
         radius = self.request.query_params.get('radius', None)
         lng = self.request.query_params.get('lng', None)
         lat = self.request.query_params.get('lat', None)
-        if radius and lng and lat:
-            user_location = fromstr("POINT(%s %s)" % (lng, lat))
-            pois = PointOfInterest.objects.filter(location__distance_lte=(user_location, Distance(km=radius)))
-            return pois
+        bbox = self.request.query_params.get('bbox', None)
+        exclude_bbox = self.request.query_params.get('exclude_bbox', None)
+        if bbox:
+            exclude_bbox = parse_bbox(exclude_bbox) if exclude_bbox else None
+            return PointOfInterest.objects.in_bbox(parse_bbox(bbox), exclude_bbox=exclude_bbox)
+        elif radius and lng and lat:
+            return PointOfInterest.objects.nearby(lng, lat, radius)
         else:
             return None
 
+    @action(methods=['get'], detail=False, url_name='nearest', url_path='nearest')
+    def nearest(self, arg):
+        """
+            Return the closest POIs ordered by distance
+
+              parameters:
+                - name: lng
+                in: query
+                type: float
+                required: true
+                description: Origin point longitude
+
+                - name: lat
+                in: query
+                type: float
+                required: true
+                description: Origin point latitude
+
+                - name: limit
+                in: query
+                type: integer
+                description: Number of POIs to return
+
+                - name: max_distance
+                in: query
+                type: float
+                description: Maximum distance in km
+        """
+        lng = self.request.query_params.get('lng', None)
+        lat = self.request.query_params.get('lat', None)
+        limit = self.request.query_params.get('limit', get_nearest_default_limit())
+        max_distance = self.request.query_params.get('max_distance', None)
+        if lng and lat:
+            try:
+                lng, lat = float(lng), float(lat)
+                max_distance = float(max_distance) if max_distance is not None else None
+            except ValueError:
+                raise ParseError('lng, lat and max_distance must be numbers')
+            try:
+                limit = min(max(int(limit), 1), get_nearest_max_limit())
+            except ValueError:
+                raise ParseError('limit must be an integer')
+            pois = PointOfInterest.objects.nearest(lng, lat, limit, max_distance=max_distance)
+            serializer = NearestPointOfInterestSerializer(pois, many=True, context={'request': self.request})
+            return Response(serializer.data)
+        return Response(None, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(methods=['get'], detail=False, url_name='clusters', url_path='clusters')
+    def clusters(self, arg):
+        """
+            Return the POIs of a bounding box grouped in clusters for a zoom level
+
+              parameters:
+                - name: bbox
+                in: query
+                type: string
+                required: true
+                description: Bounding box as minx,miny,maxx,maxy
+
+                - name: zoom
+                in: query
+                type: integer
+                required: true
+                description: Map zoom level
+        """
+        bbox = self.request.query_params.get('bbox', None)
+        zoom = self.request.query_params.get('zoom', None)
+        if bbox and zoom:
+            try:
+                zoom = min(max(int(zoom), 0), 22)
+            except ValueError:
+                raise ParseError('zoom must be an integer')
+            clusters = PointOfInterest.objects.clusters(parse_bbox(bbox), zoom)
+            serializer = PointOfInterestClusterSerializer(clusters, many=True)
+            return Response(serializer.data)
+        return Response(None, status=status.HTTP_400_BAD_REQUEST)
+
 
 class RouteViewSet(viewsets.ModelViewSet):
     """
@@ -76,6 +186,15 @@ class RouteViewSet(viewsets.ModelViewSet):
         required: true
         description: Origin point latitude
 
+        - name: bbox
+        in: query
+        type: string
+        description: Bounding box as minx,miny,maxx,maxy, replaces lat/lng/radius
+
+        - name: exclude_bbox
+        in: query
+        type: string
+        description: Already fetched bounding box as minx,miny,maxx,maxy
     """
 
     queryset = Route.objects.all()
@@ -88,9 +207,39 @@ class RouteViewSet(viewsets.ModelViewSet):
         radius = self.request.query_params.get('radius', None)
         lng = self.request.query_params.get('lng', None)
         lat = self.request.query_params.get('lat', None)
-        if radius and lng and lat:
-            user_location = fromstr("POINT(%s %s)" % (lng, lat))
-            routes = Route.objects.filter(points__location=(user_location, Distance(km=radius)))
-            return routes
+        bbox = self.request.query_params.get('bbox', None)
+        exclude_bbox = self.request.query_params.get('exclude_bbox', None)
+        if bbox:
+            exclude_bbox = parse_bbox(exclude_bbox) if exclude_bbox else None
+            return Route.objects.in_bbox(parse_bbox(bbox), exclude_bbox=exclude_bbox)
+        elif radius and lng and lat:
+            return Route.objects.nearby(lng, lat, radius)
         else:
             return None
+
+
+class TileView(APIView):
+    """
+    Mapbox Vector Tile of the `pointofinterest` and `route` layers
+
+      parameters:
+        - name: If-None-Match
+        in: header
+        type: string
+        description: ETag of a previously fetched tile
+    """
+
+    def get(self, request, z, x, y):
+        z, x, y = int(z), int(x), int(y)
+        if z > 22 or x >= 2 ** z or y >= 2 ** z:
+            raise NotFound('tile %s/%s/%s does not exist !' % (z, x, y))
+
+        data, etag = get_tile(z, x, y)
+        etag = '"%s"' % etag
+        if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(data, content_type='application/vnd.mapbox-vector-tile')
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization',))
+        return response
@@ -29,6 +29,11 @@ class Profile(models.Model):
     phone_number = models.CharField(max_length=17, default='', blank=True, validators=(phone_regex,))
     relationship = models.CharField(max_length=40, default='', blank=True, validators=(relationship_regex,))
     rank = models.IntegerField(default=0)
+    # Denormalized from rest_friendship, repaired by the `recount_relationships` command
+    friend_count = models.PositiveIntegerField(default=0, editable=False)
+    follower_count = models.PositiveIntegerField(default=0, editable=False)
+    following_count = models.PositiveIntegerField(default=0, editable=False)
+    COUNTERS = ('friend_count', 'follower_count', 'following_count')
 
     def __str__(self):
         return self.pseudo + ' - ' + self.owner.username
@@ -36,6 +41,13 @@ class Profile(models.Model):
     def get_absolute_url(self):
         return reverse('profile-detail', args=[str(self.id)])
 
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        # The counters are only written with F() updates, never save stale in-memory values over them
+        if update_fields is None and not force_insert and not self._state.adding:
+            update_fields = [field.name for field in self._meta.concrete_fields
+                             if not field.primary_key and field.name not in self.COUNTERS]
+        super(Profile, self).save(force_insert, force_update, using, update_fields)
+
     class Meta:
         verbose_name = _('Profile')
         verbose_name_plural = _('Profiles')
@@ -69,7 +69,7 @@ class ProfileViewTests(BaseTestCase):
         req = self.factory.get(url)
         profile = Profile.objects.filter(id=self.user_bob.profile.id)
         serializer = ProfileSerializer(profile, many=True, context={'request': req})
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
         self.assertResponse200(response)
         self.client.force_authenticate()
 
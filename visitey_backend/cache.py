@@ -0,0 +1,50 @@
+from urllib.parse import parse_qs, urlparse
+
+# Cache URL schemes, `redis` needs the django-redis package
+BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+    'memcached': 'django.core.cache.backends.memcached.MemcachedCache',
+    'pylibmc': 'django.core.cache.backends.memcached.PyLibMCCache',
+    'redis': 'django_redis.cache.RedisCache',
+}
+
+
+def config(url, **defaults):
+    """
+    Build a CACHES entry from a url, in the spirit of dj_database_url:
+
+        locmem://[name]
+        db://table
+        memcached://host:port[,host:port]
+        pylibmc://[user:password@]host:port[,host:port]
+        redis://[:password@]host:port/db
+
+    `timeout`, `prefix` and `version` query parameters map to the
+    TIMEOUT, KEY_PREFIX and VERSION settings.
+    """
+    url = urlparse(url)
+    if url.scheme not in BACKENDS:
+        raise ValueError("Unknown cache scheme '%s'" % url.scheme)
+
+    cache = dict(defaults, BACKEND=BACKENDS[url.scheme])
+    hosts = url.netloc.rsplit('@', 1)[-1]
+    if url.scheme in ('memcached', 'pylibmc'):
+        cache['LOCATION'] = hosts.split(',')
+        if url.username:
+            cache['OPTIONS'] = {'binary': True, 'username': url.username, 'password': url.password}
+    elif url.scheme == 'redis':
+        cache['LOCATION'] = url._replace(query='').geturl()
+    elif url.scheme == 'db':
+        cache['LOCATION'] = hosts or url.path.lstrip('/')
+    else:
+        cache['LOCATION'] = hosts
+
+    query = parse_qs(url.query)
+    if 'timeout' in query:
+        cache['TIMEOUT'] = int(query['timeout'][0])
+    if 'prefix' in query:
+        cache['KEY_PREFIX'] = query['prefix'][0]
+    if 'version' in query:
+        cache['VERSION'] = int(query['version'][0])
+    return cache
@@ -0,0 +1,20 @@
+from django.conf import settings
+from rest_framework import pagination
+
+
+# Create your pagination here
+
+class CursorPagination(pagination.CursorPagination):
+    """
+    Keyset pagination on an indexed ordering, views can override the
+    default `-id` ordering with a `cursor_ordering` attribute.
+    """
+    ordering = ('-id',)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'MAX_PAGE_SIZE', 100)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', None)
+        if ordering is not None:
+            return ordering
+        return super(CursorPagination, self).get_ordering(request, queryset, view)
@@ -14,6 +14,8 @@ import os
 
 import dj_database_url
 
+from visitey_backend import cache as cache_url
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -55,9 +57,15 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.JSONParser',
     ],
     'EXCEPTION_HANDLER':
-        'rest_framework_friendly_errors.handlers.drf_exception_handler'
+        'rest_framework_friendly_errors.handlers.drf_exception_handler',
+    # Keyset pagination, see visitey_backend.pagination
+    'DEFAULT_PAGINATION_CLASS': 'visitey_backend.pagination.CursorPagination',
+    'PAGE_SIZE': 50,
 }
 
+# Upper bound of the `page_size` query parameter
+MAX_PAGE_SIZE = 100
+
 # REST AUTH CUSTOM SERIALIZERS
 REST_AUTH_SERIALIZERS = {
     'USER_DETAILS_SERIALIZER': 'rest_profile.serializers.UserDetailsSerializer',
@@ -184,6 +192,32 @@ DATABASES = {
 
 }
 
+# Caches
+# The social graph caches of rest_friendship use their own alias, point
+# SOCIAL_CACHE_URL to memcached or redis so every worker shares them, e.g.
+# memcached://127.0.0.1:11211?prefix=social&version=1
+
+# The POI and vector tile caches of rest_geo likewise use GEO_CACHE_URL,
+# with a per-process locmem backend they are only kept for a few seconds
+
+CACHES = {
+    'default': cache_url.config(os.getenv('CACHE_URL', 'locmem://default')),
+    'social': cache_url.config(os.getenv('SOCIAL_CACHE_URL', 'locmem://social'), KEY_PREFIX='social'),
+    'geo': cache_url.config(os.getenv('GEO_CACHE_URL', 'locmem://geo'), KEY_PREFIX='geo'),
+}
+
+GEO_CACHE_ALIAS = 'geo'
+
+REST_FRIENDSHIP = {
+    'CACHE_ALIAS': 'social',
+    # Events published by one worker must reach the pollers of the others
+    'EVENT_BROKER': 'rest_friendship.events.CacheBroker',
+}
+
+# Each friendship events long poll holds a gunicorn thread (see Procfile),
+# keep most of them for the other requests
+FRIENDSHIP_EVENTS_MAX_WAITERS = int(os.getenv('FRIENDSHIP_EVENTS_MAX_WAITERS', 4))
+
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
 
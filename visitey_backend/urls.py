@@ -55,6 +55,7 @@ router.register(r'follow', FollowViewSet, base_name='follow')
 urlpatterns = [
     url(r'^', include('rest_auth.urls')),
     url(r'^social/', include('rest_social.urls')),
+    url(r'^tiles/', include('rest_geo.urls')),
     url(r'^registration/account-confirm-email/(?P<key>\w+)/$', allauthemailconfirmation, name="account_confirm_email"),
     url(r'^registration/', include('rest_auth.registration.urls')),
     url(r'^refresh-token/', refresh_jwt_token),